@@ -0,0 +1,153 @@
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse, HttpResponseNotModified
+from courses.views import InstructorCoursesList, approve_child_course, update_my_metas, pending_links_for, \
+    enabled_links_for
+from courses.dashboard import get_user_meta_courses, get_add_link_formset_class, get_user_requested_courses
+from courses.pagination import get_page, page_prefix
+from courses.response_cache import etag_matches
+from courses.instrumentation import render, with_timed_queries
+from courses.forms import UpdateMetaLinkedCoursesFormset, RemoveMetaLinkedCoursesFormset
+
+# Async versions of the course search and the GET pages of the status and my meta courses views, for ASGI
+#  deployments. While a request waits on the database, the event loop serves other requests instead of a worker
+#  being held for the whole round trip, and the independent queries of one page run at the same time. The sync
+#  views in views.py stay as they are for WSGI deployments.
+
+
+def _closing_connections(func):
+    func = with_timed_queries(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Database connections belong to the thread that opened them, so this thread's are looked after here
+            #  rather than at the end of the request: closed, unless CONN_MAX_AGE lets them be reused by the next
+            #  query run in this thread (see db_routing.py).
+            close_old_connections()
+    return wrapper
+
+
+def run_sync(func):
+    """
+    Wraps a sync view (or render) to be run in the request's thread, with its queries timed.
+    """
+    return sync_to_async(with_timed_queries(func))
+
+
+async def run_query(func, *args):
+    """
+    Runs func(*args) in a thread of its own, with its own database connection, so that several can run at once.
+    """
+    return await sync_to_async(_closing_connections(func), thread_sensitive=False)(*args)
+
+
+def load_page(queryset, number, per_page):
+    """
+    Like get_page, but also fetches the page's rows, so that nothing is left to query when the page is rendered.
+    """
+    page = get_page(queryset, number, per_page)
+    len(page.object_list)
+    return page
+
+
+def check_search_policies(request):
+    """
+    Runs the authentication, permission, throttling and content negotiation checks Rest Framework applies to
+     InstructorCoursesList. Returns the error response if a check fails, otherwise None.
+    """
+    view = InstructorCoursesList()
+    view.args, view.kwargs = (), {}
+    drf_request = view.initialize_request(request)
+    view.request = drf_request
+    view.headers = view.default_response_headers
+    try:
+        view.initial(drf_request)
+    except Exception as exc:
+        # Rendered by Django, like any other Rest Framework response.
+        return view.finalize_response(drf_request, view.handle_exception(exc))
+    return None
+
+
+async def instructor_courses_search(request):
+    """
+    Async version of InstructorCoursesList. Applies the same Rest Framework checks, takes the same query parameters
+     and returns the same JSON, ETag and 304 responses.
+    """
+    error_response = await run_query(check_search_policies, request)
+    if error_response is not None:
+        return error_response
+
+    status_code, etag, data = await run_query(InstructorCoursesList.cached_search, request.GET)
+    if etag is None:
+        return JsonResponse(data, status=status_code, safe=False)
+
+    if etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH')):
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(data, safe=False)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+async def approve_child_course_async(request):
+    """
+    Async version of approve_child_course. The user's requested courses and their page of pending requests are
+     fetched at the same time. POSTs are handled by approve_child_course.
+    """
+    if request.method != 'GET':
+        return await run_sync(approve_child_course)(request)
+
+    # SHIBBOLETH USE
+    # username = request.META['cn']  # 'cn' could also be replaced with 'REMOTE_USER'
+
+    username = 'sean_s'  # FOR TESTING ONLY
+    page_size = getattr(settings, 'FORMSET_PAGE_SIZE', 50)
+
+    (requested_page, user_requested_courses), pending_page = await asyncio.gather(
+        run_query(get_user_requested_courses, username, request.GET.get('requested_page'), page_size),
+        run_query(load_page, pending_links_for(username), request.GET.get('page'), page_size))
+
+    formset = UpdateMetaLinkedCoursesFormset(queryset=pending_page.object_list,
+                                             prefix=page_prefix('form', pending_page.number))
+    context = {'formset': formset, 'pending_page': pending_page,
+               'user_requested_courses': user_requested_courses, 'requested_page': requested_page}
+
+    return await run_sync(render)(request, 'courses/status.html', context)
+
+
+async def update_my_metas_async(request):
+    """
+    Async version of update_my_metas. The user's meta courses, their add link formset class and their page of
+     enabled links are fetched at the same time. POSTs are handled by update_my_metas.
+    """
+    if request.method != 'GET':
+        return await run_sync(update_my_metas)(request)
+
+    # SHIBBOLETH USE
+    # username = request.META['cn']  # 'cn' could also be replaced with 'REMOTE_USER'
+
+    username = 'sean_s'  # FOR TESTING ONLY
+    user_meta_courses, add_link_formset_cls, enabled_page = await asyncio.gather(
+        run_query(get_user_meta_courses, username),
+        run_query(get_add_link_formset_class, username),
+        run_query(load_page, enabled_links_for(username), request.GET.get('page'),
+                  getattr(settings, 'FORMSET_PAGE_SIZE', 50)))
+
+    remove_link_formset = RemoveMetaLinkedCoursesFormset(queryset=enabled_page.object_list,
+                                                         prefix=page_prefix('remove_link_formset',
+                                                                            enabled_page.number))
+    add_link_formset = add_link_formset_cls(prefix='add_link_formset')
+    context = {'remove_link_formset': remove_link_formset,
+               'enabled_page': enabled_page,
+               'user_meta_courses': user_meta_courses,
+               'add_link_formset': add_link_formset}
+
+    return await run_sync(render)(request, 'courses/my_meta_courses.html', context)
@@ -0,0 +1,315 @@
+import json
+import platform
+import random
+import time
+
+from django.core import mail
+from django.core.mail import get_connection
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from courses.models import BbMetaCourses, BbMetaLinkedCourses, InstructorCourses
+from courses.outbox import deliver_outbox
+from courses.pagination import page_prefix
+from courses.views import InstructorCoursesList, CreateMetaCourse, approve_child_course, update_my_metas
+
+# The views are hard-coded to this user (see the SHIBBOLETH USE comments), so the data is generated around them.
+BENCHMARK_USER = 'sean_s'
+
+SEMESTERS = ('S', 'U', 'F')
+DEPARTMENTS = ('ACCT', 'BIOL', 'CHEM', 'ENGL', 'HIST', 'MATH', 'PHYS', 'PSYC')
+
+
+def make_course_id(year, semester, department, number, section):
+    # The first 4 characters are the term, as latest_term() in views.py expects.
+    return '{0:02d}{1}{2}{3:04d}{4:03d}'.format(year, semester, department, number, section)
+
+
+def generate_data(scale, seed=0, batch_size=5000, user_courses=60, pending_requests=2000):
+    """
+    Fills the database with synthetic data: scale InstructorCourses rows taught by about scale / 8 instructors,
+     one BbMetaCourses per 20 sections, and 3 BbMetaLinkedCourses rows per meta course. BENCHMARK_USER teaches
+     user_courses of the sections and has pending_requests requests from other instructors waiting for approval.
+    Returns the number of rows created per model.
+
+    The InstructorCourses rows are created and inserted batch_size at a time, so memory use doesn't grow with scale.
+    """
+    rng = random.Random(seed)
+    instructors = ['instr{0:06d}'.format(i) for i in range(max(scale // 8, 1))]
+
+    # A sample of the sections, with their instructors, to link meta courses to. It's a reservoir sample, so it's
+    #  taken as the sections are generated instead of from a list of all of them.
+    sample_size = min(scale, 100000)
+    sections = []
+    user_sections = []
+    course_rows = []
+    for i in range(scale):
+        course_id = make_course_id(10 + i % 10, SEMESTERS[(i // 10) % 3], DEPARTMENTS[(i // 30) % len(DEPARTMENTS)],
+                                   1000 + (i // 240) % 9000, i // 2160000 + 1)
+        instructor = BENCHMARK_USER if i < user_courses else rng.choice(instructors)
+        if i < user_courses:
+            user_sections.append((course_id, instructor))
+        if i < sample_size:
+            sections.append((course_id, instructor))
+        else:
+            position = rng.randrange(i + 1)
+            if position < sample_size:
+                sections[position] = (course_id, instructor)
+
+        course_rows.append(InstructorCourses(course_id=course_id, instructor_username=instructor))
+        if len(course_rows) >= batch_size:
+            InstructorCourses.objects.bulk_create(course_rows)
+            course_rows = []
+    if course_rows:
+        InstructorCourses.objects.bulk_create(course_rows)
+
+    meta_count = max(scale // 20, 1)
+    metas = []
+    for i in range(meta_count):
+        owner = BENCHMARK_USER if i % 50 == 0 else rng.choice(instructors)
+        metas.append(BbMetaCourses(instructor_id=owner, meta_course_id='meta_{0}_bench{1}'.format(owner, i),
+                                   meta_course_name='(Meta 19F) Benchmark Meta Course {0} (001, 002)'.format(i)))
+    BbMetaCourses.objects.bulk_create(metas, batch_size=batch_size)
+    # bulk_create only sets primary keys on some databases, so the meta courses are read back.
+    meta_pks = list(BbMetaCourses.objects.filter(meta_course_id__contains='_bench')
+                    .values_list('pk', 'instructor_id'))
+
+    links = []
+    for meta_pk, owner in meta_pks:
+        for child_course, child_instructor in rng.sample(sections, 3):
+            links.append(BbMetaLinkedCourses(meta_course_pk1_id=meta_pk, child_course=child_course, requestor=owner,
+                                             child_course_instructor=child_instructor,
+                                             row_status=0 if child_instructor == owner else rng.choice((0, 1, 2))))
+    other_metas = [(meta_pk, owner) for meta_pk, owner in meta_pks if owner != BENCHMARK_USER]
+    for i in range(pending_requests):
+        meta_pk, owner = rng.choice(other_metas)
+        links.append(BbMetaLinkedCourses(meta_course_pk1_id=meta_pk, child_course=rng.choice(user_sections)[0],
+                                         requestor=owner, child_course_instructor=BENCHMARK_USER, row_status=1))
+    BbMetaLinkedCourses.objects.bulk_create(links, batch_size=batch_size)
+
+    return {'InstructorCourses': scale, 'BbMetaCourses': len(meta_pks), 'BbMetaLinkedCourses': len(links)}
+
+
+def search_terms(rng, count):
+    """
+    Realistic search terms: what users type into the search boxes, from a couple of characters up to a full id.
+    """
+    terms = []
+    for i in range(count):
+        course_id = make_course_id(10 + rng.randrange(10), rng.choice(SEMESTERS), rng.choice(DEPARTMENTS),
+                                   1000 + rng.randrange(100), 1)
+        terms.append(course_id[:rng.randint(2, len(course_id))].lower())
+    return terms
+
+
+def management_form(prefix, total, initial=0):
+    return {prefix + '-TOTAL_FORMS': str(total), prefix + '-INITIAL_FORMS': str(initial),
+            prefix + '-MIN_NUM_FORMS': '0', prefix + '-MAX_NUM_FORMS': '1000'}
+
+
+class Scenarios(object):
+    """
+    The requests the benchmark makes. Each scenario returns a request for a view; the form field names follow
+     courses.forms.
+
+    The requests are made with RequestFactory and passed straight to the views, not sent through the test client,
+     so URL resolution and the middleware (TimingMiddleware, ReplicaRoutingMiddleware, sessions, CSRF) aren't part
+     of the measured time. The views aren't routed by a URLconf in this app for the test client to go through.
+    """
+
+    def __init__(self, seed=0, formset_size=10):
+        self.rng = random.Random(seed)
+        self.factory = RequestFactory()
+        self.formset_size = formset_size
+        self.terms = search_terms(self.rng, 200)
+        self.user_courses = list(InstructorCourses.objects.filter(instructor_username=BENCHMARK_USER)
+                                 .values_list('course_id', flat=True)[:formset_size])
+        self.foreign_courses = list(InstructorCourses.objects.exclude(instructor_username=BENCHMARK_USER)
+                                    .values_list('course_id', flat=True)[:1000])
+        self.user_meta_pks = list(BbMetaCourses.objects.filter(instructor_id=BENCHMARK_USER)
+                                  .values_list('pk', flat=True)[:100])
+
+    def all(self):
+        return [
+            ('search_user', InstructorCoursesList.as_view(), self.search_user),
+            ('search_course', InstructorCoursesList.as_view(), self.search_course),
+            ('search_both_page_2', InstructorCoursesList.as_view(), self.search_both),
+            ('search_cursor', InstructorCoursesList.as_view(), self.search_cursor),
+            ('create_meta_course_get', CreateMetaCourse.as_view(), self.create_meta_course_get),
+            ('create_meta_course_post', CreateMetaCourse.as_view(), self.create_meta_course_post),
+            ('status_get', approve_child_course, self.status_get),
+            ('status_post', approve_child_course, self.status_post),
+            ('my_metas_get', update_my_metas, self.my_metas_get),
+            ('my_metas_post', update_my_metas, self.my_metas_post),
+        ]
+
+    def search_user(self):
+        return self.factory.get('/', {'search_user': 'instr{0:03d}'.format(self.rng.randrange(1000))})
+
+    def search_course(self):
+        return self.factory.get('/', {'search_course': self.rng.choice(self.terms)})
+
+    def search_both(self):
+        return self.factory.get('/', {'search_user': 'instr', 'search_course': self.rng.choice(self.terms),
+                                      'page': 2})
+
+    def search_cursor(self):
+        return self.factory.get('/', {'search_course': self.rng.choice(self.terms), 'cursor': ''})
+
+    def create_meta_course_get(self):
+        return self.factory.get('/')
+
+    def create_meta_course_post(self):
+        data = {'meta_course_name': 'Benchmark Meta Course', 'sections': '001, 002'}
+        data.update(management_form('user_courses_formset', len(self.user_courses)))
+        for i, course_id in enumerate(self.user_courses):
+            data['user_courses_formset-{0}-child_course'.format(i)] = course_id
+        foreign_courses = self.rng.sample(self.foreign_courses, min(self.formset_size, len(self.foreign_courses)))
+        data.update(management_form('foreign_courses_formset', len(foreign_courses)))
+        for i, course_id in enumerate(foreign_courses):
+            data['foreign_courses_formset-{0}-child_course'.format(i)] = course_id
+        return self.factory.post('/', data)
+
+    def status_get(self):
+        return self.factory.get('/status/')
+
+    def status_post(self):
+        # Approves or denies up to formset_size of the pending requests on the first page.
+        pending = list(BbMetaLinkedCourses.objects.filter(child_course_instructor=BENCHMARK_USER, row_status=1)
+                       .order_by('pk').values_list('pk', flat=True)[:self.formset_size])
+        prefix = page_prefix('form', 1)
+        pk_name = BbMetaLinkedCourses._meta.pk.name
+        data = {'page': '1'}
+        data.update(management_form(prefix, len(pending), len(pending)))
+        for i, pk in enumerate(pending):
+            data['{0}-{1}-{2}'.format(prefix, i, pk_name)] = str(pk)
+            data['{0}-{1}-row_status'.format(prefix, i)] = str(self.rng.choice((0, 2)))
+        return self.factory.post('/status/', data)
+
+    def my_metas_get(self):
+        return self.factory.get('/metacourses/')
+
+    def my_metas_post(self):
+        prefix = page_prefix('remove_link_formset', 1)
+        data = {'page': '1'}
+        data.update(management_form(prefix, 0))
+        count = min(self.formset_size, len(self.foreign_courses))
+        data.update(management_form('add_link_formset', count))
+        for i, course_id in enumerate(self.rng.sample(self.foreign_courses, count)):
+            data['add_link_formset-{0}-meta_course_pk1'.format(i)] = str(self.rng.choice(self.user_meta_pks))
+            data['add_link_formset-{0}-child_course'.format(i)] = course_id
+        return self.factory.post('/metacourses/', data)
+
+
+def percentile(values, percent):
+    """
+    Returns the given percentile of values, interpolating between the closest ranks.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * percent / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def deliver_emails(email_connection):
+    """
+    Delivers every due message in the outbox over email_connection, a local-memory email backend, and returns the
+     number of emails sent, as counted in django.core.mail.outbox.
+    """
+    sent_before = len(mail.outbox)
+    while any(deliver_outbox(connection=email_connection)):
+        pass
+    return len(mail.outbox) - sent_before
+
+
+def run_scenario(view, make_request, iterations, warmup=3):
+    """
+    Calls view iterations times and returns latency percentiles (ms), SQL queries and emails sent per request.
+
+    The emails a request queues are delivered by deliver_outbox() to a local-memory backend after the request,
+     outside the timed part, and counted there. Digests are sent straight away (NOTIFICATION_DIGEST_WINDOW = 0), so
+     each request's notifications are counted as the emails they're actually sent as.
+    """
+    # Creates django.core.mail.outbox.
+    email_connection = get_connection('django.core.mail.backends.locmem.EmailBackend')
+    latencies = []
+    queries = []
+    emails = []
+    # Messages left over from earlier requests aren't counted against the first one.
+    deliver_emails(email_connection)
+    for i in range(warmup + iterations):
+        request = make_request()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = view(request)
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                response.render()
+            elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError('{0} returned {1}'.format(getattr(view, '__name__', view), response.status_code))
+        sent = deliver_emails(email_connection)
+        if i >= warmup:
+            latencies.append(elapsed * 1000)
+            queries.append(len(captured.captured_queries))
+            emails.append(sent)
+
+    return {
+        'iterations': iterations,
+        'latency_ms': {'p50': percentile(latencies, 50), 'p90': percentile(latencies, 90),
+                       'p99': percentile(latencies, 99), 'max': max(latencies)},
+        'queries_per_request': sum(queries) / float(len(queries)),
+        'emails_per_request': sum(emails) / float(len(emails)),
+    }
+
+
+@override_settings(NOTIFICATION_DIGEST_WINDOW=0)
+def run_benchmarks(iterations, seed=0, formset_size=10, only=None):
+    scenarios = Scenarios(seed=seed, formset_size=formset_size)
+    results = {}
+    for name, view, make_request in scenarios.all():
+        if only and name not in only:
+            continue
+        results[name] = run_scenario(view, make_request, iterations)
+    return {
+        'created': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'rows': {'InstructorCourses': InstructorCourses.objects.count(),
+                 'BbMetaCourses': BbMetaCourses.objects.count(),
+                 'BbMetaLinkedCourses': BbMetaLinkedCourses.objects.count()},
+        'scenarios': results,
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares benchmark results against a saved baseline and returns a list of regressions: scenarios whose p50 or
+     p90 latency grew by more than tolerance (a fraction), or that make more SQL queries or send more emails.
+    """
+    regressions = []
+    for name, result in results['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        for stat in ('p50', 'p90'):
+            now, before = result['latency_ms'][stat], base['latency_ms'][stat]
+            if now > before * (1 + tolerance):
+                regressions.append('{0}: {1} latency {2:.1f} ms -> {3:.1f} ms'.format(name, stat, before, now))
+        for stat in ('queries_per_request', 'emails_per_request'):
+            if result[stat] > base[stat]:
+                regressions.append('{0}: {1} {2:g} -> {3:g}'.format(name, stat, base[stat], result[stat]))
+    return regressions
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,205 @@
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from functools import partial
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from courses.models import InstructorCourses
+from courses.generations import get_generation
+from courses.db_routing import use_primary
+
+
+class CourseCatalog(object):
+    """
+    Read-through snapshot of InstructorCourses for point lookups: whether a course_id exists, who teaches it, and
+     which courses an instructor teaches.
+
+    The rows are stored sorted by course_id in parallel arrays: a list of interned course_id strings, an array of
+     instructor numbers (indexes into a table of interned usernames) and an array of primary keys. Each username
+     and course_id is stored once, so tens of thousands of sections take a few MB.
+
+    The snapshot is loaded on first use. After that it's patched by the post_save/post_delete signals below, and
+     when the 'instructor_courses' generation (see generations.py) shows another process changed the table, it's
+     refreshed incrementally: rows with a primary key above the highest one already loaded are added, and the
+     snapshot is only reloaded if the row count shows rows were deleted. Changes made in place by other processes
+     are picked up by a full reload every COURSE_CATALOG_MAX_AGE seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+        self._generation = None
+        self._loaded_at = None
+
+    def _clear(self):
+        self._instructors = []  # Instructor number -> username
+        self._instructor_numbers = {}  # Username -> instructor number
+        self._course_ids = []  # One per row, sorted
+        self._row_instructors = array('l')
+        self._row_pks = array('q')
+        self._instructor_courses = {}  # Instructor number -> sorted list of course_ids
+        self._max_pk = 0
+
+    def __len__(self):
+        return len(self._row_pks)
+
+    def is_loaded(self):
+        return self._loaded_at is not None
+
+    def _instructor_number(self, username):
+        number = self._instructor_numbers.get(username)
+        if number is None:
+            number = len(self._instructors)
+            username = sys.intern(username)
+            self._instructors.append(username)
+            self._instructor_numbers[username] = number
+        return number
+
+    def _add(self, pk, course_id, instructor_username):
+        course_id = sys.intern(course_id)
+        number = self._instructor_number(instructor_username)
+        # Rows of the same course are kept in primary key order, whatever order they're added in.
+        lo = bisect_left(self._course_ids, course_id)
+        hi = bisect_right(self._course_ids, course_id, lo)
+        position = bisect_right(self._row_pks, pk, lo, hi)
+        self._course_ids.insert(position, course_id)
+        self._row_instructors.insert(position, number)
+        self._row_pks.insert(position, pk)
+        insort(self._instructor_courses.setdefault(number, []), course_id)
+        self._max_pk = max(self._max_pk, pk)
+
+    def _remove(self, pk):
+        try:
+            position = self._row_pks.index(pk)
+        except ValueError:
+            return
+        course_id = self._course_ids.pop(position)
+        number = self._row_instructors.pop(position)
+        self._row_pks.pop(position)
+        courses = self._instructor_courses[number]
+        courses.pop(bisect_left(courses, course_id))
+
+    def reload(self, generation=None):
+        rows = InstructorCourses.objects.order_by('pk').values_list('pk', 'course_id', 'instructor_username')
+        # Sorted here rather than by the database, whose collation may not match Python's string ordering. The sort
+        #  is stable, so rows of the same course stay in primary key order.
+        rows = sorted(rows.iterator(), key=itemgetter(1))
+        with self._lock:
+            self._clear()
+            for pk, course_id, instructor_username in rows:
+                course_id = sys.intern(course_id)
+                number = self._instructor_number(instructor_username)
+                self._course_ids.append(course_id)
+                self._row_instructors.append(number)
+                self._row_pks.append(pk)
+                self._instructor_courses.setdefault(number, []).append(course_id)
+                self._max_pk = max(self._max_pk, pk)
+            self._generation = generation
+            self._loaded_at = time.time()
+
+    def refresh(self, generation=None):
+        """
+        Brings the snapshot up to date with the fewest queries it can: new rows are fetched by primary key and
+         added, and only if rows were deleted is the whole snapshot reloaded.
+        """
+        with self._lock:
+            new_rows = InstructorCourses.objects.filter(pk__gt=self._max_pk).order_by('pk')\
+                .values_list('pk', 'course_id', 'instructor_username')
+            for pk, course_id, instructor_username in new_rows:
+                self._add(pk, course_id, instructor_username)
+            if InstructorCourses.objects.count() != len(self._row_pks):
+                self.reload(generation)
+            else:
+                self._generation = generation
+
+    def ensure_fresh(self):
+        # The generation is read before the table, so a change made while loading leaves it out of date.
+        generation = get_generation('instructor_courses')
+        max_age = getattr(settings, 'COURSE_CATALOG_MAX_AGE', 600)
+        # Loaded from the primary, since a replica may not have the changes that bumped the generation yet.
+        with self._lock, use_primary():
+            if self._loaded_at is None or (max_age is not None and time.time() - self._loaded_at > max_age):
+                self.reload(generation)
+            elif generation != self._generation:
+                self.refresh(generation)
+
+    def add(self, pk, course_id, instructor_username):
+        # Adding a pk that is already in the snapshot replaces the old row, so this also handles updates.
+        with self._lock:
+            self._remove(pk)
+            self._add(pk, course_id, instructor_username)
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+
+    def instructor_of(self, course_id):
+        """
+        Returns the username of the instructor teaching course_id, or None if there is no such course.
+        If the course has more than one instructor, the one from the row with the lowest primary key is returned.
+        """
+        self.ensure_fresh()
+        with self._lock:
+            return self._instructor_of(course_id)
+
+    def instructors_of(self, course_ids):
+        """
+        Returns {course_id: instructor_username} for each of course_ids that exists.
+        """
+        self.ensure_fresh()
+        instructors = {}
+        with self._lock:
+            for course_id in course_ids:
+                instructor = self._instructor_of(course_id)
+                if instructor is not None:
+                    instructors[course_id] = instructor
+        return instructors
+
+    def _instructor_of(self, course_id):
+        position = bisect_left(self._course_ids, course_id)
+        if position < len(self._course_ids) and self._course_ids[position] == course_id:
+            return self._instructors[self._row_instructors[position]]
+        return None
+
+    def courses_of(self, username):
+        """
+        Returns a sorted list of the course_ids taught by username.
+        """
+        self.ensure_fresh()
+        with self._lock:
+            number = self._instructor_numbers.get(username)
+            if number is None:
+                return []
+            return list(self._instructor_courses[number])
+
+
+course_catalog = CourseCatalog()
+
+
+# The catalog is only patched once a change commits, so a rolled back change never reaches it.
+def _add_if_loaded(pk, course_id, instructor_username):
+    # If the catalog hasn't been loaded yet, the row will be picked up when it is.
+    if course_catalog.is_loaded():
+        course_catalog.add(pk, course_id, instructor_username)
+
+
+def _remove_if_loaded(pk):
+    if course_catalog.is_loaded():
+        course_catalog.remove(pk)
+
+
+@receiver(post_save, sender=InstructorCourses, dispatch_uid='course_catalog_save')
+def update_course_catalog(sender, instance, **kwargs):
+    transaction.on_commit(partial(_add_if_loaded, instance.pk, instance.course_id, instance.instructor_username))
+
+
+@receiver(post_delete, sender=InstructorCourses, dispatch_uid='course_catalog_delete')
+def remove_from_course_catalog(sender, instance, **kwargs):
+    # The pk is taken now; delete() clears it from the instance before the transaction commits.
+    transaction.on_commit(partial(_remove_if_loaded, instance.pk))
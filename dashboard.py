@@ -0,0 +1,101 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.forms import formset_factory
+from courses.models import BbMetaCourses, BbMetaLinkedCourses
+from courses.forms import create_add_link_form
+from courses.generations import get_generation, bump_generation
+from courses.pagination import get_page
+from courses.response_cache import LRUCache
+from courses.db_routing import use_primary
+
+
+def user_generation(username):
+    return 'user:' + username
+
+
+class DashboardCache(LRUCache):
+    """
+    Per-user cache of the structures the status and my meta courses pages build for a user, including the dynamic
+     add link formset class.
+
+    Every key includes the user's generation (see generations.py), which is bumped once a transaction that changes
+     one of the user's BbMetaCourses or BbMetaLinkedCourses rows commits, whether the user or another instructor
+     made the change. Values are kept in-process, since form classes can't be stored in a shared cache.
+    """
+
+    def get_or_build(self, username, name, build):
+        key = (username, get_generation(user_generation(username)), name)
+        value = self.get(key)
+        if value is None:
+            # Built from the primary, since a replica may not have the changes that bumped the generation yet.
+            with use_primary():
+                value = build()
+            self.set(key, value)
+        return value
+
+
+dashboard_cache = DashboardCache(getattr(settings, 'DASHBOARD_CACHE_MAX_ENTRIES', 1000),
+                                 getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300))
+
+
+def invalidate_users(usernames):
+    """
+    Invalidates the cached structures of the given users once the current transaction commits. Changes that don't
+     send signals (bulk_create, bulk_update, queryset.update) have to call this themselves.
+    """
+    for username in set(usernames):
+        transaction.on_commit(partial(bump_generation, user_generation(username)))
+
+
+def get_user_meta_courses(username):
+    return dashboard_cache.get_or_build(username, 'user_meta_courses', lambda: list(
+        BbMetaCourses.objects.filter(instructor_id=username).values('pk1', 'meta_course_name')))
+
+
+def get_add_link_formset_class(username):
+    # create_add_link_form is a function wrapping the AddLinkedCoursesForm class; this is done to limit the meta course
+    # choices the user can select, i.e. displaying only the user's meta courses instead of every meta course.
+    return dashboard_cache.get_or_build(username, 'add_link_formset_class',
+                                        lambda: formset_factory(create_add_link_form(username)))
+
+
+def get_user_requested_courses(username, page_number, page_size):
+    """
+    Returns (page, user_requested_courses) for one page of the courses the user has requested to be added to any
+     meta course they created, that are awaiting approval. user_requested_courses groups the page by meta course:
+     {meta_course_name: [{'child_course': ..., 'child_course_instructor': ...}, ...]}.
+    """
+    def build():
+        requested_page = get_page(BbMetaLinkedCourses.objects.filter(requestor=username).filter(row_status=1)
+                                  .order_by('meta_course_pk1__meta_course_name', 'pk')
+                                  .values('meta_course_pk1__meta_course_name', 'child_course',
+                                          'child_course_instructor'),
+                                  page_number, page_size)
+        # The page's rows are cached rather than its queryset, which would run again every time the cached page is
+        #  rendered. The paginator's count was taken when the page was, so it isn't counted again either.
+        requested_page.object_list = list(requested_page.object_list)
+        user_requested_courses = {}
+        for course in requested_page.object_list:
+            user_requested_courses.setdefault(course['meta_course_pk1__meta_course_name'], [])\
+                .append({'child_course': course['child_course'],
+                         'child_course_instructor': course['child_course_instructor']})
+        return requested_page, user_requested_courses
+
+    return dashboard_cache.get_or_build(username, ('user_requested_courses', page_number, page_size), build)
+
+
+@receiver(post_save, sender=BbMetaCourses, dispatch_uid='dashboard_meta_course_save')
+@receiver(post_delete, sender=BbMetaCourses, dispatch_uid='dashboard_meta_course_delete')
+def invalidate_meta_course_owner(sender, instance, **kwargs):
+    invalidate_users([instance.instructor_id])
+
+
+@receiver(post_save, sender=BbMetaLinkedCourses, dispatch_uid='dashboard_linked_course_save')
+@receiver(post_delete, sender=BbMetaLinkedCourses, dispatch_uid='dashboard_linked_course_delete')
+def invalidate_linked_course_users(sender, instance, **kwargs):
+    # Both the user who requested the course and the course's instructor see the link.
+    invalidate_users([instance.requestor, instance.child_course_instructor])
@@ -0,0 +1,128 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+# Read replicas, for read-heavy deployments.
+#
+# With ReplicaRouter in DATABASE_ROUTERS, reads go to one of the database aliases in COURSES_READ_REPLICAS, picked at
+#  random per query, and writes (along with select_for_update(), which Django treats as a write) go to the 'default'
+#  database. ReplicaRoutingMiddleware sends every read of a POST (or other unsafe request) to the primary, and for
+#  COURSES_REPLICA_LAG seconds afterwards it keeps sending the same browser's reads there, so the page a POST
+#  redirects to (/status/, /metacourses/) shows what was just written.
+#
+# Persistent connections: set CONN_MAX_AGE (and CONN_HEALTH_CHECKS) on every alias so each worker thread keeps its
+#  connections between requests instead of opening them per request. On PostgreSQL with Django 5.1 or later,
+#  OPTIONS = {'pool': True} (or a dict of psycopg_pool.ConnectionPool arguments) pools them instead; leave
+#  CONN_MAX_AGE at 0 then. Behind PgBouncer in transaction mode, also set DISABLE_SERVER_SIDE_CURSORS.
+#
+# For example, with two SQLite files standing in for a primary and its replica (copy db.sqlite3 to
+#  replica.sqlite3 after migrating; changes made since the copy show up as replication lag):
+#
+#   DATABASES = {
+#       'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'db.sqlite3', 'CONN_MAX_AGE': 600,
+#                   'CONN_HEALTH_CHECKS': True},
+#       'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'replica.sqlite3', 'CONN_MAX_AGE': 600,
+#                   'CONN_HEALTH_CHECKS': True, 'TEST': {'MIRROR': 'default'}},
+#   }
+#   DATABASE_ROUTERS = ['courses.db_routing.ReplicaRouter']
+#   COURSES_READ_REPLICAS = ['replica']
+#   MIDDLEWARE = ['courses.db_routing.ReplicaRoutingMiddleware', ...]
+
+# True while the reads of the current request (or block, see use_primary) have to see the primary's data.
+_use_primary = ContextVar('courses_use_primary', default=False)
+
+
+def read_replicas():
+    return list(getattr(settings, 'COURSES_READ_REPLICAS', ()))
+
+
+@contextmanager
+def use_primary():
+    """
+    Sends the reads made in the block to the primary. Use it for reads that decide what to write, and for data
+     that is cached under the current generation (see generations.py), which a lagging replica may not have yet.
+    """
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        replicas = read_replicas()
+        if not replicas or _use_primary.get():
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary, so objects read from any of them can be related.
+        databases = set([DEFAULT_DB_ALIAS] + read_replicas())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replicas get their schema from the primary.
+        return db not in read_replicas()
+
+
+class ReplicaRoutingMiddleware(object):
+    """
+    Sends the reads of unsafe requests to the primary, and sets a cookie that sends the same browser's reads there
+     for the next COURSES_REPLICA_LAG seconds (10 by default), so that the redirect after a POST reads its writes.
+
+    Only used when COURSES_READ_REPLICAS is set.
+    """
+
+    cookie_name = 'courses_use_primary'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not read_replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        unsafe = self.is_unsafe(request)
+        token = _use_primary.set(unsafe or self.cookie_name in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_primary.reset(token)
+        return self.finish(unsafe, response)
+
+    async def __acall__(self, request):
+        # The threads the async views run their queries in get a copy of this context, so they see the setting.
+        unsafe = self.is_unsafe(request)
+        token = _use_primary.set(unsafe or self.cookie_name in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _use_primary.reset(token)
+        return self.finish(unsafe, response)
+
+    @staticmethod
+    def is_unsafe(request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def finish(self, unsafe, response):
+        if unsafe:
+            response.set_cookie(self.cookie_name, '1', max_age=getattr(settings, 'COURSES_REPLICA_LAG', 10),
+                                httponly=True, samesite='Lax')
+        return response
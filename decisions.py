@@ -0,0 +1,67 @@
+from django.db import transaction
+from courses.models import BbMetaLinkedCourses
+from courses.notifications import DECISIONS, user_email
+from courses.outbox import enqueue_digest
+from courses.dashboard import invalidate_users
+from courses.lms_feed import record_link_changes
+
+ENABLED = 0
+PENDING = 1
+DISABLED = 2
+ROW_STATUSES = (ENABLED, PENDING, DISABLED)
+
+
+class InvalidDecision(Exception):
+    pass
+
+
+def apply_decisions(username, decisions):
+    """
+    Approves (row_status 0) or denies (row_status 2) pending requests to use username's child courses.
+    decisions is an iterable of (BbMetaLinkedCourses pk, row_status) pairs; pairs with row_status 1 leave the
+     request pending.
+
+    Every decision is checked before anything is written, and all the changed rows are then written with one
+     bulk_update in one transaction, along with the notification emails to their requestors. If any decision is
+     invalid, InvalidDecision is raised and nothing is changed. Returns the number of requests decided.
+    """
+    statuses = {}
+    for pk, row_status in decisions:
+        # Checked by type first, since False and 0.0 compare equal to 0.
+        if type(row_status) is not int or row_status not in ROW_STATUSES:
+            raise InvalidDecision('Invalid row_status {0!r} for request {1!r}.'.format(row_status, pk))
+        statuses[pk] = row_status
+
+    with transaction.atomic():
+        # Only the user's own pending requests can be decided. They're locked so that two submissions can't decide
+        #  the same request twice.
+        links = list(BbMetaLinkedCourses.objects.select_for_update()
+                     .filter(pk__in=statuses.keys(), child_course_instructor=username, row_status=PENDING)
+                     .order_by('pk'))
+        missing = set(statuses) - set(link.pk for link in links)
+        if missing:
+            raise InvalidDecision('Requests {0} are not pending requests for your courses.'
+                                  .format(', '.join(str(pk) for pk in sorted(missing))))
+
+        decided_links = []
+        # Approved and denied child courses, grouped by requestor: {requestor: [[row_status, child_course], ...]}
+        requestor_decisions = {}
+        for link in links:
+            row_status = statuses[link.pk]
+            if row_status != PENDING:
+                link.row_status = row_status
+                decided_links.append(link)
+                requestor_decisions.setdefault(link.requestor, []).append([row_status, link.child_course])
+
+        BbMetaLinkedCourses.objects.bulk_update(decided_links, ['row_status'])
+        # bulk_update doesn't send signals, so the cached pages of the requestors are invalidated and the changes
+        #  recorded for the LMS feed here.
+        invalidate_users([username] + list(requestor_decisions.keys()))
+        record_link_changes(decided_links)
+
+        # Approved and denied courses are listed in one email per requestor, queued with the row_status changes
+        #  and sent later by the deliver_outbox command.
+        for requestor, child_courses in requestor_decisions.items():
+            enqueue_digest(DECISIONS, user_email(requestor), child_courses)
+
+    return len(decided_links)
@@ -0,0 +1,52 @@
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from courses.models import InstructorCourses
+
+
+# Generation counters are kept in a Django cache (COURSES_GENERATION_CACHE, 'default' if it isn't set) so every
+#  process sharing that cache sees a bump. A local-memory cache only covers the current process; a file based
+#  cache covers every process on the machine.
+GENERATION_KEY = 'courses:generation:{0}'
+
+
+def _cache():
+    return caches[getattr(settings, 'COURSES_GENERATION_CACHE', 'default')]
+
+
+def get_generation(name):
+    """
+    Returns the current generation number of name. Anything derived from the data behind name (cached responses,
+     in-memory indexes) is out of date once the number changes.
+    """
+    cache = _cache()
+    key = GENERATION_KEY.format(name)
+    generation = cache.get(key)
+    if generation is None:
+        # add() won't overwrite a generation another process set in the meantime.
+        cache.add(key, 1, timeout=None)
+        generation = cache.get(key, 1)
+    return generation
+
+
+def bump_generation(name):
+    cache = _cache()
+    key = GENERATION_KEY.format(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The key is missing (never set, or culled by the cache)
+        cache.set(key, 2, timeout=None)
+        return 2
+
+
+@receiver(post_save, sender=InstructorCourses, dispatch_uid='instructor_courses_generation_save')
+@receiver(post_delete, sender=InstructorCourses, dispatch_uid='instructor_courses_generation_delete')
+def bump_instructor_courses_generation(sender, **kwargs):
+    # Bumped once the change commits: other processes reload as soon as they see the new generation, and would
+    #  otherwise reload before the change is visible to them (or after it was rolled back).
+    transaction.on_commit(partial(bump_generation, 'instructor_courses'))
@@ -0,0 +1,238 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.shortcuts import render as django_render
+
+# Timings of the request being handled: {phase: [count, seconds]}, or None when instrumentation is off.
+_current_timings = ContextVar('courses_request_timings', default=None)
+
+# Upper bounds (ms) of the histogram buckets; the last bucket has no upper bound.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# View name the timings of requests that didn't resolve to a view are recorded under.
+UNRESOLVED = '<unresolved>'
+
+
+# The async views record from several threads at once into the same request's timings.
+_record_lock = threading.Lock()
+
+
+def record(phase, seconds, count=1):
+    timings = _current_timings.get()
+    if timings is not None:
+        with _record_lock:
+            entry = timings.setdefault(phase, [0, 0.0])
+            entry[0] += count
+            entry[1] += seconds
+
+
+@contextmanager
+def timed(phase):
+    """
+    Adds the time spent in the block to phase in the current request's timings. Does nothing outside of an
+     instrumented request.
+    """
+    if _current_timings.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+
+def timed_function(phase):
+    """
+    Decorator version of timed().
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Used by the function-based views instead of django.shortcuts.render, so that template rendering is timed.
+render = timed_function('render')(django_render)
+
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def as_dict(self):
+        buckets = dict(('le_{0}'.format(bound), count) for bound, count in zip(BUCKETS, self.counts))
+        buckets['inf'] = self.counts[-1]
+        return {'count': self.total, 'sum': round(self.sum, 3), 'buckets': buckets}
+
+
+class TimingStats(object):
+    """
+    In-process histograms of request timings (ms) and query counts, per view and phase.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def add(self, view_name, timings, total_seconds):
+        with self._lock:
+            for phase, (count, seconds) in timings.items():
+                self._histogram(view_name, phase + '_ms').add(seconds * 1000)
+                if phase == 'db':
+                    self._histogram(view_name, 'db_queries').add(count)
+            self._histogram(view_name, 'total_ms').add(total_seconds * 1000)
+
+    def _histogram(self, view_name, metric):
+        key = (view_name, metric)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        return histogram
+
+    def snapshot(self):
+        with self._lock:
+            views = {}
+            for (view_name, metric), histogram in self._histograms.items():
+                views.setdefault(view_name, {})[metric] = histogram.as_dict()
+            return views
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+
+timing_stats = TimingStats()
+
+
+def time_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', time.perf_counter() - start)
+
+
+@contextmanager
+def timed_queries():
+    """
+    Adds the queries made in the block on this thread's database connections to the current request's timings.
+    Does nothing outside of an instrumented request.
+    """
+    if _current_timings.get() is None:
+        yield
+        return
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(time_query))
+        yield
+
+
+def with_timed_queries(func):
+    """
+    Decorator version of timed_queries(), for functions the async views run in other threads.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with timed_queries():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def server_timing(timings, total_seconds):
+    """
+    Formats timings as the value of a Server-Timing header.
+    """
+    metrics = []
+    for phase, (count, seconds) in sorted(timings.items()):
+        metric = '{0};dur={1:.2f}'.format(phase, seconds * 1000)
+        if phase == 'db':
+            metric += ';desc="{0} queries"'.format(count)
+        metrics.append(metric)
+    metrics.append('total;dur={0:.2f}'.format(total_seconds * 1000))
+    return ', '.join(metrics)
+
+
+class TimingMiddleware(object):
+    """
+    Records where each request's time goes: database queries (count and time), queueing email, serialization,
+     template rendering and the total. The timings are sent back in a Server-Timing header and added to the
+     histograms in timing_stats.
+
+    Only used when COURSES_TIMING_ENABLED is True; otherwise Django drops the middleware when it starts, so it
+     costs nothing. Under ASGI it stays async, so the async views aren't moved to a thread; their queries run in
+     other threads, which time them with timed_queries() (see async_views.py).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'COURSES_TIMING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = {}
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with timed_queries():
+                response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings = {}
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    def finish(self, request, response, timings, total_seconds):
+        response['Server-Timing'] = server_timing(timings, total_seconds)
+        resolver_match = getattr(request, 'resolver_match', None)
+        # Requests that didn't resolve share one name, so that requests for made-up paths can't add histograms
+        #  without limit.
+        view_name = (resolver_match.view_name if resolver_match else None) or UNRESOLVED
+        timing_stats.add(view_name, timings, total_seconds)
+        return response
+
+    def process_template_response(self, request, response):
+        # TemplateResponses (CreateView) and Rest Framework Responses are rendered after the view returns.
+        # Rest Framework responses are rendered by their JSON renderer, so that counts as serialization.
+        phase = 'serialize' if hasattr(response, 'accepted_renderer') else 'render'
+        start = time.perf_counter()
+
+        def render_finished(response):
+            record(phase, time.perf_counter() - start)
+
+        response.add_post_render_callback(render_finished)
+        return response
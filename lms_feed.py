@@ -0,0 +1,170 @@
+import csv
+import datetime
+import json
+
+from django.apps import apps
+from django.db import models
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# Columns of the feed. row_status is 0 (enabled) for every row of a full export; a delta also has rows with
+#  row_status 2 (disabled) for mappings that were enabled once, and have since been disabled or deleted.
+FEED_FIELDS = ('meta_course_id', 'child_course', 'child_course_instructor', 'row_status')
+
+FEED_CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+# MetaLinkChange lives here instead of in courses/models.py to keep the feed in one place; models.py imports it
+#  (from courses.lms_feed import MetaLinkChange) so that it's picked up by migrations. This module doesn't import
+#  courses.models, so that import can go anywhere in models.py: the link models are looked up through the app
+#  registry when they're used, and the signals below name their sender as a string.
+class MetaLinkChange(models.Model):
+    """
+    Records that the link of child_course to a meta course changed, so that a "changed since" export only has to
+     look at the mappings that changed. meta_course_id and child_course_instructor are copied, so that deleted
+     links can still be exported as disabled.
+    """
+
+    meta_course_pk1 = models.IntegerField()
+    meta_course_id = models.CharField(max_length=100)
+    child_course = models.CharField(max_length=100)
+    child_course_instructor = models.CharField(max_length=100)
+    # The link's row_status after the change (before it, for deletes), so that mappings that were never enabled
+    #  can be left out of deltas.
+    row_status = models.IntegerField()
+    changed = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        app_label = 'courses'
+        ordering = ['pk']
+        # Deltas look up the earlier changes of each changed mapping, to tell whether it was ever enabled.
+        indexes = [models.Index(fields=['meta_course_pk1', 'child_course'])]
+
+
+def _model(name):
+    return apps.get_model('courses', name)
+
+
+def record_link_changes(links):
+    """
+    Records changes to the given BbMetaLinkedCourses rows. Changes that don't send signals (bulk_create,
+     bulk_update, queryset.update) have to call this themselves, in the transaction that makes them.
+    """
+    links = list(links)
+    if not links:
+        return
+    meta_course_pk1s = set(link.meta_course_pk1_id for link in links)
+    meta_course_ids = dict(_model('BbMetaCourses').objects.filter(pk1__in=meta_course_pk1s)
+                           .values_list('pk1', 'meta_course_id'))
+    MetaLinkChange.objects.bulk_create([
+        MetaLinkChange(meta_course_pk1=link.meta_course_pk1_id,
+                       meta_course_id=meta_course_ids.get(link.meta_course_pk1_id, ''),
+                       child_course=link.child_course, child_course_instructor=link.child_course_instructor,
+                       row_status=link.row_status)
+        for link in links])
+
+
+def _same_mapping(model, **filters):
+    return model.objects.filter(meta_course_pk1=OuterRef('meta_course_pk1'), child_course=OuterRef('child_course'),
+                                **filters)
+
+
+def prune_link_changes(days):
+    """
+    Deletes recorded changes older than days, except the ones showing that a mapping that still exists was enabled,
+     which later deltas need to tell whether it's the LMS's to disable. Returns the number deleted.
+    """
+    return MetaLinkChange.objects.filter(changed__lt=timezone.now() - datetime.timedelta(days=days))\
+        .exclude(Exists(_same_mapping(_model('BbMetaLinkedCourses'))), row_status=0).delete()[0]
+
+
+def parse_since(value):
+    """
+    Parses the since of a delta export, an ISO 8601 datetime taken to be in the current time zone if it doesn't
+     have one. Returns None if value is None, and raises ValueError if it isn't a valid datetime.
+    """
+    if value is None:
+        return None
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError('{0!r} is not an ISO 8601 datetime.'.format(value))
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def enabled_mappings(chunk_size=2000):
+    """
+    Yields every enabled parent/child mapping as a tuple of FEED_FIELDS, reading chunk_size rows at a time from a
+     server-side cursor.
+    """
+    return _model('BbMetaLinkedCourses').objects.filter(row_status=0).order_by('meta_course_pk1', 'pk')\
+        .values_list('meta_course_pk1__meta_course_id', 'child_course', 'child_course_instructor', 'row_status')\
+        .iterator(chunk_size=chunk_size)
+
+
+def changed_mappings(since, chunk_size=2000):
+    """
+    Yields the current state of every mapping changed after since, once each, as a tuple of FEED_FIELDS: row_status
+     0 if the child course is enabled in the meta course now, otherwise 2. Mappings that have never been enabled
+     (pending and denied requests) are left out, since the LMS has never seen them.
+
+    Rows are the current state rather than a history, so exporting the same change twice does no harm; the feed job
+     can overlap the windows it asks for to cover transactions that were still open during the last export.
+    """
+    changes = MetaLinkChange.objects.filter(changed__gt=since)\
+        .annotate(enabled=Exists(_same_mapping(_model('BbMetaLinkedCourses'), row_status=0)),
+                  was_enabled=Exists(_same_mapping(MetaLinkChange, row_status=0)))\
+        .order_by('meta_course_pk1', 'child_course', '-pk')\
+        .values_list('meta_course_pk1', 'child_course', 'meta_course_id', 'child_course_instructor', 'enabled',
+                     'was_enabled')\
+        .iterator(chunk_size=chunk_size)
+
+    last = None
+    for meta_course_pk1, child_course, meta_course_id, child_course_instructor, is_enabled, was_enabled in changes:
+        # Only the newest change of each mapping is used.
+        if (meta_course_pk1, child_course) == last:
+            continue
+        last = (meta_course_pk1, child_course)
+        if is_enabled or was_enabled:
+            yield meta_course_id, child_course, child_course_instructor, 0 if is_enabled else 2
+
+
+class _Echo(object):
+    # csv.writer only needs an object with a write() method; this one hands back the formatted line.
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FEED_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(FEED_FIELDS, row))) + '\n'
+
+
+FEED_WRITERS = {'csv': csv_lines, 'ndjson': ndjson_lines}
+
+
+def feed_lines(feed_format, since=None, chunk_size=2000):
+    """
+    Yields the lines of the LMS feed in feed_format ('csv' or 'ndjson'): every enabled mapping, or only the
+     mappings changed after since if it's given.
+    """
+    rows = enabled_mappings(chunk_size) if since is None else changed_mappings(since, chunk_size)
+    return FEED_WRITERS[feed_format](rows)
+
+
+@receiver(post_save, sender='courses.BbMetaLinkedCourses', dispatch_uid='lms_feed_linked_course_save')
+@receiver(pre_delete, sender='courses.BbMetaLinkedCourses', dispatch_uid='lms_feed_linked_course_delete')
+def record_linked_course_change(sender, instance, **kwargs):
+    # Deletes are recorded before the row goes, while its meta course (which may be going too) is still there.
+    record_link_changes([instance])
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from courses.benchmarks import generate_data, run_benchmarks, compare, save_results, load_results
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the course views against synthetic data and compares the results with a saved baseline. ' \
+           'Run it against a scratch SQLite or PostgreSQL database: the POST scenarios write to it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', type=int, metavar='ROWS',
+                            help='First fill the database with this many InstructorCourses rows (10000 to 1000000) '
+                                 'and matching meta courses and links.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=50, help='Requests per scenario.')
+        parser.add_argument('--formset-size', type=int, default=10,
+                            help='Number of forms in each submitted formset.')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Only run this scenario; may be given more than once.')
+        parser.add_argument('--output', help='Save the results as JSON to this file, e.g. to use as a baseline.')
+        parser.add_argument('--compare', metavar='BASELINE', help='Compare the results with this saved baseline.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Latency increase allowed before --compare reports a regression (0.2 = 20%%).')
+
+    def handle(self, *args, **options):
+        if options['generate']:
+            start = time.perf_counter()
+            created = generate_data(options['generate'], seed=options['seed'])
+            self.stdout.write('Generated {0} in {1:.1f}s'.format(
+                ', '.join('{0} {1}'.format(count, model) for model, count in sorted(created.items())),
+                time.perf_counter() - start))
+
+        results = run_benchmarks(options['iterations'], seed=options['seed'], formset_size=options['formset_size'],
+                                 only=options['scenarios'])
+
+        self.stdout.write('{0:<26} {1:>9} {2:>9} {3:>9} {4:>9} {5:>8}'.format(
+            'scenario', 'p50 ms', 'p90 ms', 'p99 ms', 'queries', 'emails'))
+        for name, result in sorted(results['scenarios'].items()):
+            latency = result['latency_ms']
+            self.stdout.write('{0:<26} {1:>9.2f} {2:>9.2f} {3:>9.2f} {4:>9.1f} {5:>8.2f}'.format(
+                name, latency['p50'], latency['p90'], latency['p99'], result['queries_per_request'],
+                result['emails_per_request']))
+
+        if options['output']:
+            save_results(results, options['output'])
+            self.stdout.write('Saved results to {0}'.format(options['output']))
+
+        if options['compare']:
+            regressions = compare(results, load_results(options['compare']), options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against {0}:\n  {1}'.format(options['compare'],
+                                                                           '\n  '.join(regressions)))
+            self.stdout.write('No regressions against {0}.'.format(options['compare']))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from courses.outbox import deliver_outbox
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued emails from the outbox in batches over one reused email connection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of messages sent over each connection.')
+        parser.add_argument('--interval', type=float, default=10,
+                            help='Seconds to wait before checking again when the outbox is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Deliver everything that is currently due, then exit.')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                sent, failed = deliver_outbox(batch_size=options['batch_size'])
+            except Exception as e:
+                # Usually the email server couldn't be reached; nothing in the batch was changed.
+                if options['once']:
+                    raise
+                self.stderr.write('Outbox delivery failed: {0}'.format(e))
+                time.sleep(options['interval'])
+                continue
+
+            if sent or failed:
+                self.stdout.write('Sent {0} message(s), {1} failed.'.format(sent, failed))
+            # A full batch usually means more messages are waiting, so only sleep once a batch comes up short.
+            if sent + failed < options['batch_size']:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from courses.lms_feed import FEED_WRITERS, feed_lines, parse_since, prune_link_changes
+
+
+class Command(BaseCommand):
+    help = 'Writes the enabled meta course to child course mappings for the LMS feed, streaming them from the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FEED_WRITERS), default='csv')
+        parser.add_argument('--since',
+                            help='Only export the mappings changed after this ISO 8601 datetime, disabled ones '
+                                 'included.')
+        parser.add_argument('--output', default='-', help='File to write the feed to, or - for standard output.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of rows read from the database at a time.')
+        parser.add_argument('--prune-days', type=int,
+                            help='Afterwards, delete the recorded changes older than this many days.')
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_since(options['since'])
+        except ValueError:
+            raise CommandError('--since must be an ISO 8601 datetime.')
+
+        # Taken before the rows are read, so nothing that changes during the export is missed by the next one.
+        changed_until = timezone.now()
+        lines = feed_lines(options['format'], since, options['chunk_size'])
+        if options['output'] == '-':
+            sys.stdout.writelines(lines)
+        else:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+
+        # Reported on stderr so it doesn't end up in a feed written to stdout.
+        self.stderr.write('Changed until {0}; pass it as --since on the next run.'.format(changed_until.isoformat()))
+
+        if options['prune_days'] is not None:
+            pruned = prune_link_changes(options['prune_days'])
+            self.stderr.write('Pruned {0} recorded change(s).'.format(pruned))
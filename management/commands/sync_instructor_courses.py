@@ -0,0 +1,67 @@
+import io
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from courses.registrar_sync import FEED_READERS, FeedError, UnsafeSync, sync_instructor_courses
+
+
+class Command(BaseCommand):
+    help = ('Makes InstructorCourses match a registrar export (CSV or NDJSON), inserting and deleting only the rows '
+            'that differ, in small transactions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The registrar export, or - to read it from standard input.')
+        parser.add_argument('--format', choices=sorted(FEED_READERS),
+                            help='Format of the export. Taken from the file extension if not given.')
+        parser.add_argument('--course-id-field', default='course_id',
+                            help='Name of the course id column or key.')
+        parser.add_argument('--instructor-field', default='instructor_username',
+                            help='Name of the instructor username column or key.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rows inserted or deleted in each transaction.')
+        parser.add_argument('--run-size', type=int, default=100000,
+                            help='Number of rows sorted in memory at a time.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would change without writing anything.')
+        parser.add_argument('--max-delete', type=float, default=0.25,
+                            help='Refuse to delete more than this fraction of the existing rows.')
+        parser.add_argument('--force', action='store_true',
+                            help='Sync even if the export is empty or more than --max-delete rows would be deleted.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        feed_format = options['format']
+        if feed_format is None:
+            extension = os.path.splitext(path)[1].lstrip('.').lower()
+            feed_format = {'jsonl': 'ndjson', 'json': 'ndjson'}.get(extension, extension)
+            if feed_format not in FEED_READERS:
+                raise CommandError('Can\'t tell the format of {0}; use --format.'.format(path))
+
+        if path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        else:
+            try:
+                stream = open(path, encoding='utf-8', newline='')
+            except OSError as e:
+                raise CommandError(e)
+
+        def progress(stats):
+            self.stdout.write('{0} read, {1} inserted, {2} deleted ({3:.0f} rows/s)'.format(
+                stats.read, stats.inserted, stats.deleted, stats.rows_per_second))
+
+        with stream:
+            pairs = FEED_READERS[feed_format](stream, options['course_id_field'], options['instructor_field'])
+            try:
+                stats = sync_instructor_courses(pairs, batch_size=options['batch_size'],
+                                                run_size=options['run_size'], dry_run=options['dry_run'],
+                                                progress=progress, max_delete=options['max_delete'],
+                                                force=options['force'])
+            except FeedError as e:
+                raise CommandError(e)
+            except UnsafeSync as e:
+                raise CommandError('{0} Nothing was changed; check the export, or use --force.'.format(e))
+
+        self.stdout.write('{0}{1} rows read, {2} inserted, {3} deleted in {4:.1f}s ({5:.0f} rows/s).'.format(
+            'Dry run: ' if options['dry_run'] else '', stats.read, stats.inserted, stats.deleted, stats.elapsed,
+            stats.rows_per_second))
@@ -0,0 +1,71 @@
+FROM_EMAIL = 'EMAIL REMOVED'
+
+HELP_DESK = 'If you have any questions or concerns, please contact the IT@UC Help Desk by ' \
+            + 'telephone at 513-556-HELP (4357) or by email at helpdesk@uc.edu.'
+
+# Digest kinds. Notifications of the same kind to the same recipient are combined into one email (see
+#  courses.outbox.enqueue_digest), and the email is rendered from all of their items when it's sent.
+APPROVAL_REQUESTS = 'approval_requests'  # items are the requested child course_ids
+DECISIONS = 'decisions'  # items are [row_status, child_course] pairs
+
+APPROVED = 0
+DENIED = 2
+
+
+def user_email(username):
+    return username + '@ucmail.uc.edu'
+
+
+def render_approval_requests(course_ids):
+    """
+    Returns the (subject, message) of an email asking an instructor to approve the use of their courses.
+    """
+    subject = '[BB Meta Courses] New Request for Approval'
+    if len(course_ids) == 1:
+        message = 'An instructor has requested to use one of your courses in a Meta Course. ' \
+                  + 'Please visit [URL REMOVED FROM PUBLIC CODE] to approve or deny this request. '
+    else:
+        message = 'Instructors have requested to use the following courses of yours in Meta Courses:\n\n' \
+                  + ''.join('    {0}\n'.format(course_id) for course_id in course_ids) + '\n' \
+                  + 'Please visit [URL REMOVED FROM PUBLIC CODE] to approve or deny these requests. '
+    message = message + HELP_DESK
+    return subject, message
+
+
+def render_decisions(decisions):
+    """
+    Returns the (subject, message) of an email telling a requestor which of their requests have been approved
+     or denied.
+    """
+    if len(decisions) == 1:
+        # A single decision gets the same email as before digests.
+        row_status, child_course = decisions[0]
+        if row_status == APPROVED:
+            subject = '[BB Meta Courses] One Of Your Requests Has Been Approved'
+            message = 'Your request to use {0} has been approved. '.format(child_course)
+        else:
+            subject = '[BB Meta Courses] One Of Your Requests Has Been Denied'
+            message = 'Your request to use {0} has been Denied. '.format(child_course)
+        return subject, message + HELP_DESK
+
+    approved = [child_course for row_status, child_course in decisions if row_status == APPROVED]
+    denied = [child_course for row_status, child_course in decisions if row_status == DENIED]
+    subject = '[BB Meta Courses] {0} Of Your Requests Have Been Reviewed'.format(len(decisions))
+    message = ''
+    if approved:
+        message += 'Your requests to use the following courses have been approved:\n\n' \
+                   + ''.join('    {0}\n'.format(child_course) for child_course in approved) + '\n'
+    if denied:
+        message += 'Your requests to use the following courses have been denied:\n\n' \
+                   + ''.join('    {0}\n'.format(child_course) for child_course in denied) + '\n'
+    return subject, message + HELP_DESK
+
+
+DIGEST_RENDERERS = {
+    APPROVAL_REQUESTS: render_approval_requests,
+    DECISIONS: render_decisions,
+}
+
+
+def render_digest(digest, items):
+    return DIGEST_RENDERERS[digest](items)
@@ -0,0 +1,170 @@
+import datetime
+import json
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+from courses.notifications import FROM_EMAIL, render_digest
+from courses.instrumentation import timed_function
+
+logger = logging.getLogger(__name__)
+
+
+# OutboxMessage lives here instead of in courses/models.py to keep the outbox in one place; models.py imports it
+#  (from courses.outbox import OutboxMessage) so that it's picked up by migrations.
+class OutboxMessage(models.Model):
+    """
+    An email waiting to be delivered by deliver_outbox(). Views enqueue messages in the same transaction as the
+     writes they're about, so a message exists if and only if its data was saved.
+
+    Digest messages (digest isn't blank) collect items until they're sent, and their subject and body are rendered
+     from those items by courses.notifications.render_digest().
+    """
+
+    subject = models.CharField(max_length=255, blank=True)
+    body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    # Recipient addresses, separated by commas
+    recipients = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    # The message won't be sent before this time; failed messages are pushed back by the retry backoff.
+    send_after = models.DateTimeField(default=timezone.now, db_index=True)
+    sent_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Set while a deliver_outbox() worker is sending the message; a claim that outlives OUTBOX_CLAIM_TIMEOUT is
+    #  taken to be from a worker that died, and the message is sent again.
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Kind of digest (see courses.notifications), and its items as a JSON list
+    digest = models.CharField(max_length=50, blank=True)
+    items = models.TextField(blank=True)
+
+    class Meta:
+        app_label = 'courses'
+        ordering = ['pk']
+
+    def recipient_list(self):
+        return [address for address in self.recipients.split(',') if address]
+
+    def to_email_message(self, connection=None):
+        if self.digest:
+            subject, body = render_digest(self.digest, json.loads(self.items))
+        else:
+            subject, body = self.subject, self.body
+        return EmailMessage(subject, body, self.from_email, self.recipient_list(), connection=connection)
+
+
+@timed_function('email')
+def enqueue_digest(digest, recipient, items):
+    """
+    Adds items to the digest of the given kind that is waiting to be sent to the recipient email address, or queues
+     a new one. Call this inside the transaction that saves the data the items are about.
+
+    A new digest is held for NOTIFICATION_DIGEST_WINDOW seconds (0 by default), so that notifications from the
+     requests made during that window go out as a single email. Notifications from the same request are always
+     combined.
+
+    Digests claimed by deliver_outbox() are left alone, and so are digests another request is adding to (rather
+     than waiting for it); a new digest is queued instead.
+    """
+    pending = OutboxMessage.objects.select_for_update(skip_locked=True)\
+        .filter(digest=digest, recipients=recipient, sent_at__isnull=True, attempts=0, claimed_until__isnull=True)\
+        .order_by('-pk').first()
+    if pending is not None:
+        pending.items = json.dumps(json.loads(pending.items) + list(items))
+        pending.save(update_fields=['items'])
+    else:
+        window = getattr(settings, 'NOTIFICATION_DIGEST_WINDOW', 0)
+        OutboxMessage.objects.create(digest=digest, items=json.dumps(list(items)), from_email=FROM_EMAIL,
+                                     recipients=recipient,
+                                     send_after=timezone.now() + datetime.timedelta(seconds=window))
+
+
+def retry_delay(attempts):
+    """
+    Seconds to wait before retrying a message that has failed attempts times: doubles from
+     OUTBOX_RETRY_DELAY (60 seconds by default), up to OUTBOX_MAX_RETRY_DELAY (an hour).
+    """
+    delay = getattr(settings, 'OUTBOX_RETRY_DELAY', 60) * 2 ** (attempts - 1)
+    return min(delay, getattr(settings, 'OUTBOX_MAX_RETRY_DELAY', 3600))
+
+
+def deliver_outbox(batch_size=100, max_attempts=None, connection=None):
+    """
+    Sends one batch of due messages over a single email connection (the EMAIL_BACKEND, unless connection is given)
+     and returns (sent, failed).
+
+    Messages that fail are retried later with an exponential backoff, until they've been tried max_attempts times
+     (OUTBOX_MAX_ATTEMPTS, 5 by default). The batch is claimed in one short transaction and marked sent or failed in
+     another, and no transaction or row lock is held while the email server is talked to, so a slow server never
+     holds up the requests queueing messages. Several workers can run at once.
+    """
+    if max_attempts is None:
+        max_attempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+    if connection is None:
+        connection = get_connection(fail_silently=False)
+
+    messages = claim_messages(batch_size, max_attempts)
+    if not messages:
+        return 0, 0
+
+    sent_pks = []
+    failed = []
+    try:
+        # If the server can't be reached at all, this raises and the claims are released below, leaving the batch
+        #  as it was for the next run.
+        connection.open()
+    except Exception:
+        OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).update(claimed_until=None)
+        raise
+    try:
+        for message in messages:
+            try:
+                connection.send_messages([message.to_email_message(connection)])
+            except Exception as e:
+                message.attempts += 1
+                message.last_error = '{0}: {1}'.format(type(e).__name__, e)
+                failed.append(message)
+                logger.warning('Outbox message %s failed (attempt %s): %s', message.pk, message.attempts,
+                               message.last_error)
+                # The connection may be unusable after an error, so start a new one for the next message.
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    # send_messages() will try to open it again.
+                    pass
+            else:
+                sent_pks.append(message.pk)
+    finally:
+        connection.close()
+
+        # Recorded even if something unexpected stopped the loop, so the messages already sent aren't sent again.
+        with transaction.atomic():
+            now = timezone.now()
+            OutboxMessage.objects.filter(pk__in=sent_pks).update(sent_at=now, claimed_until=None)
+            for message in failed:
+                message.send_after = now + datetime.timedelta(seconds=retry_delay(message.attempts))
+                message.claimed_until = None
+                message.save(update_fields=['attempts', 'last_error', 'send_after', 'claimed_until'])
+
+    return len(sent_pks), len(failed)
+
+
+def claim_messages(batch_size, max_attempts):
+    """
+    Claims up to batch_size due messages for the calling worker and returns them. The rows are only locked while
+     they're claimed; workers skip the rows another worker is claiming at the same time.
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        messages = list(OutboxMessage.objects.select_for_update(skip_locked=True)
+                        .filter(sent_at__isnull=True, send_after__lte=now, attempts__lt=max_attempts)
+                        .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+                        .order_by('pk')[:batch_size])
+        claimed_until = now + datetime.timedelta(seconds=getattr(settings, 'OUTBOX_CLAIM_TIMEOUT', 600))
+        OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).update(claimed_until=claimed_until)
+    return messages
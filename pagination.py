@@ -0,0 +1,152 @@
+import base64
+import binascii
+import heapq
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(direction, position):
+    """
+    Encodes a page direction ('next' or 'prev') and the key of the row the page starts after into an opaque,
+     URL safe cursor string.
+    """
+    raw = json.dumps([direction] + list(position), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, position_types=None):
+    """
+    Returns the (direction, position) pair encoded in cursor. An empty cursor means the first page, and is returned
+     as ('next', None). Raises InvalidCursor if the cursor wasn't made by encode_cursor, or if position_types is
+     given and the position doesn't have one value of each of those types.
+    """
+    if not cursor:
+        return 'next', None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        decoded = json.loads(raw.decode('utf-8'))
+    except (TypeError, ValueError, binascii.Error):
+        raise InvalidCursor(cursor)
+    if not isinstance(decoded, list) or len(decoded) < 2 or decoded[0] not in ('next', 'prev'):
+        raise InvalidCursor(cursor)
+    position = tuple(decoded[1:])
+    if position_types is not None and (len(position) != len(position_types) or not all(
+            isinstance(value, position_type) for value, position_type in zip(position, position_types))):
+        # A crafted position would otherwise fail when it's compared with the keys of the rows.
+        raise InvalidCursor(cursor)
+    return decoded[0], position
+
+
+class CursorPage(object):
+    """
+    One page of results from paginate_by_cursor. next_cursor/prev_cursor are None when there is nothing in that
+     direction.
+    """
+
+    def __init__(self, results, next_cursor, prev_cursor):
+        self.results = results
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def paginate_by_cursor(rows, cursor, per_page, key, position_types=None):
+    """
+    Keyset pagination over the list rows, ordered by key(row). Keys must be unique, or rows sharing a key on a page
+     boundary are skipped; end the key with the primary key if the other values can repeat. position_types are the
+     types of the values key() returns, checked against the position in the cursor (see decode_cursor).
+
+    Instead of counting the rows and skipping to an offset, each page only picks the per_page rows closest to the
+     key in the cursor, so a deep page costs the same as the first one and rows added or removed between requests
+     don't shift later pages.
+    """
+    direction, position = decode_cursor(cursor, position_types)
+
+    if direction == 'next':
+        if position is None:
+            window = rows
+        else:
+            window = [row for row in rows if key(row) > position]
+        # Any row that was filtered out comes before this page.
+        has_before = len(window) < len(rows)
+        page = heapq.nsmallest(per_page + 1, window, key=key)
+        has_after = len(page) > per_page
+        page = page[:per_page]
+    else:
+        window = [row for row in rows if key(row) < position]
+        has_after = len(window) < len(rows)
+        page = heapq.nlargest(per_page + 1, window, key=key)
+        has_before = len(page) > per_page
+        page = page[:per_page][::-1]
+
+    next_cursor = encode_cursor('next', key(page[-1])) if page and has_after else None
+    prev_cursor = encode_cursor('prev', key(page[0])) if page and has_before else None
+    return CursorPage(page, next_cursor, prev_cursor)
+
+
+def get_page(object_list, number, per_page):
+    """
+    Returns the page of object_list with the given number. Like the search results, pages that aren't an integer
+     get page 1, but pages that are out of range get the last page.
+    """
+    paginator = Paginator(object_list, per_page)
+    try:
+        return paginator.page(number)
+    except PageNotAnInteger:
+        return paginator.page(1)
+    except EmptyPage:
+        return paginator.page(paginator.num_pages)
+
+
+def posted_page_number(value):
+    """
+    Returns the page number posted with a paginated formset, as is. Unlike get_page, a page that no longer exists
+     isn't moved to the last page, since the posted forms carry the prefix of the page they came from.
+    """
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return 1
+    return number if number > 0 else 1
+
+
+def page_prefix(prefix, page_number):
+    """
+    Returns the formset prefix used for one page of a paginated formset, so that forms posted from different pages
+     can't be mixed up.
+    """
+    return '{0}-page{1}'.format(prefix, page_number)
+
+
+def page_url(path, page_number):
+    return path if page_number == 1 else '{0}?page={1}'.format(path, page_number)
+
+
+def posted_pks(data, prefix, model):
+    """
+    Returns the primary keys of the existing objects posted for the model formset with the given prefix.
+
+    Bound model formsets look up their objects in their queryset, which is every row of the model unless it's
+     given. Limiting the queryset to these keys keeps a POST from loading more than one page of rows.
+    """
+    try:
+        total_forms = int(data.get(prefix + '-TOTAL_FORMS', 0))
+    except ValueError:
+        return []
+    pk_field = model._meta.pk
+    pks = []
+    # Formsets never have more than 1000 forms (django.forms.formsets.DEFAULT_MAX_NUM).
+    for i in range(min(total_forms, 1000)):
+        pk = data.get('{0}-{1}-{2}'.format(prefix, i, pk_field.name))
+        if pk:
+            try:
+                pks.append(pk_field.to_python(pk))
+            except ValidationError:
+                # Left for the formset's own validation to report
+                pass
+    return pks
@@ -0,0 +1,247 @@
+import csv
+import heapq
+import json
+import os
+import tempfile
+import time
+from functools import partial
+
+from django.db import transaction
+from courses.models import InstructorCourses
+from courses.generations import bump_generation
+
+
+class FeedError(Exception):
+    pass
+
+
+def _clean(line_number, course_id, instructor_username):
+    course_id = (course_id or '').strip()
+    instructor_username = (instructor_username or '').strip()
+    if not course_id or not instructor_username:
+        raise FeedError('Line {0}: course_id and instructor_username are required.'.format(line_number))
+    return course_id, instructor_username
+
+
+def read_csv(stream, course_id_field='course_id', instructor_field='instructor_username'):
+    """
+    Yields (course_id, instructor_username) pairs from a CSV registrar export with a header row.
+    """
+    reader = csv.DictReader(stream)
+    missing = set((course_id_field, instructor_field)) - set(reader.fieldnames or ())
+    if missing:
+        raise FeedError('The feed has no {0} column(s).'.format(', '.join(sorted(missing))))
+    for row in reader:
+        yield _clean(reader.line_num, row[course_id_field], row[instructor_field])
+
+
+def read_ndjson(stream, course_id_field='course_id', instructor_field='instructor_username'):
+    """
+    Yields (course_id, instructor_username) pairs from a registrar export with one JSON object per line.
+    """
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise FeedError('Line {0}: {1}'.format(line_number, e))
+        yield _clean(line_number, row.get(course_id_field), row.get(instructor_field))
+
+
+FEED_READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def _read_run(path):
+    with open(path, encoding='utf-8') as run:
+        for line in run:
+            yield tuple(json.loads(line))
+
+
+def external_sort(items, run_size):
+    """
+    Yields the tuples in items in sorted order, holding at most run_size of them in memory at a time.
+
+    Each full run of run_size items is sorted and written to a temporary file, and the runs are then merged. The
+     whole of items is read before the first tuple is yielded, so a database cursor feeding items is done with
+     before any writes are made.
+    """
+    paths = []
+    try:
+        run = []
+        for item in items:
+            run.append(item)
+            if len(run) >= run_size:
+                run.sort()
+                fd, path = tempfile.mkstemp(prefix='courses-sync-', suffix='.jsonl')
+                paths.append(path)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    for row in run:
+                        f.write(json.dumps(row))
+                        f.write('\n')
+                run = []
+        run.sort()
+
+        for item in heapq.merge(run, *[_read_run(path) for path in paths]):
+            yield item
+    finally:
+        for path in paths:
+            os.remove(path)
+
+
+def diff(feed, existing):
+    """
+    Merge-joins the sorted feed pairs with the sorted (course_id, instructor_username, pk) rows of the table.
+    Yields ('insert', (course_id, instructor_username)) for pairs missing from the table and ('delete', pk) for rows
+     missing from the feed, or repeating a pair already in the table. Pairs repeated in the feed are inserted once.
+    """
+    feed = iter(feed)
+    existing = iter(existing)
+    pair = next(feed, None)
+    row = next(existing, None)
+    while pair is not None or row is not None:
+        if row is None or (pair is not None and pair < row[:2]):
+            yield 'insert', pair
+            current = pair
+        elif pair is None or row[:2] < pair:
+            yield 'delete', row[2]
+            row = next(existing, None)
+            continue
+        else:
+            current = pair
+            row = next(existing, None)
+            while row is not None and row[:2] == current:
+                yield 'delete', row[2]
+                row = next(existing, None)
+        while pair is not None and pair == current:
+            pair = next(feed, None)
+
+
+class UnsafeSync(Exception):
+    pass
+
+
+class SyncStats(object):
+    def __init__(self):
+        self.read = 0
+        self.existing = 0
+        self.inserted = 0
+        self.deleted = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+def _apply(inserts, deletes):
+    with transaction.atomic():
+        if inserts:
+            InstructorCourses.objects.bulk_create(
+                [InstructorCourses(course_id=course_id, instructor_username=instructor_username)
+                 for course_id, instructor_username in inserts])
+        if deletes:
+            # queryset.delete() would fetch every row to send pre_delete/post_delete for it, and each of those
+            #  removals costs the course catalog a scan of its rows. A raw DELETE doesn't; nothing cascades from
+            #  InstructorCourses.
+            InstructorCourses.objects.filter(pk__in=deletes)._raw_delete('default')
+
+
+def _spool(actions):
+    """
+    Writes the actions to a temporary file, so they can be counted before any of them are applied. Returns the
+     file's path and the number of inserts and deletes.
+    """
+    inserts = deletes = 0
+    fd, path = tempfile.mkstemp(prefix='courses-sync-', suffix='.jsonl')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for action, value in actions:
+                if action == 'insert':
+                    inserts += 1
+                else:
+                    deletes += 1
+                f.write(json.dumps([action, value]))
+                f.write('\n')
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, inserts, deletes
+
+
+def sync_instructor_courses(pairs, batch_size=1000, run_size=100000, dry_run=False, progress=None, max_delete=0.25,
+                            force=False):
+    """
+    Makes InstructorCourses match the (course_id, instructor_username) pairs of a registrar feed.
+
+    The feed and the existing rows are both sorted with external_sort and merge-joined, so memory use depends on
+     run_size rather than on the size of the feed. Only the differences are written: missing pairs are inserted
+     and rows that aren't in the feed are deleted, in batches of at most batch_size rows, each in a transaction
+     of its own, so the table is never locked for long. progress, if given, is called with the SyncStats after
+     every batch. Returns the SyncStats.
+
+    Neither bulk_create nor the raw DELETE sends the signals the search index, the course catalog and the search
+     response cache listen to, so they're told through the 'instructor_courses' generation instead, once the last
+     batch is written (or a batch fails), rather than after every batch.
+
+    An empty or truncated export would empty the table, so unless force is True, UnsafeSync is raised before
+     anything is written if the feed has no rows, or if more than max_delete (a fraction) of the existing rows would
+     be deleted.
+    """
+    stats = SyncStats()
+
+    def counted(rows, stat):
+        for row in rows:
+            setattr(stats, stat, getattr(stats, stat) + 1)
+            yield row
+
+    feed = external_sort(counted(pairs, 'read'), run_size)
+    # The diff decides what to write, so it's made against the primary rather than a replica.
+    existing = external_sort(counted(InstructorCourses.objects.using('default').order_by()
+                                     .values_list('course_id', 'instructor_username', 'pk')
+                                     .iterator(chunk_size=batch_size), 'existing'), run_size)
+
+    path, insert_count, delete_count = _spool(diff(feed, existing))
+    try:
+        if not force:
+            if not stats.read:
+                raise UnsafeSync('The feed has no rows; every InstructorCourses row would be deleted.')
+            if delete_count > max_delete * stats.existing:
+                raise UnsafeSync('{0} of the {1} InstructorCourses rows would be deleted, more than {2:.0%}.'
+                                 .format(delete_count, stats.existing, max_delete))
+
+        if dry_run:
+            stats.inserted, stats.deleted = insert_count, delete_count
+        elif insert_count or delete_count:
+            try:
+                with open(path, encoding='utf-8') as actions:
+                    inserts, deletes = [], []
+                    for line in actions:
+                        action, value = json.loads(line)
+                        if action == 'insert':
+                            inserts.append(value)
+                        else:
+                            deletes.append(value)
+                        if len(inserts) + len(deletes) >= batch_size:
+                            _apply(inserts, deletes)
+                            stats.inserted += len(inserts)
+                            stats.deleted += len(deletes)
+                            inserts, deletes = [], []
+                            stats.elapsed = time.perf_counter() - stats.started
+                            if progress is not None:
+                                progress(stats)
+
+                    if inserts or deletes:
+                        _apply(inserts, deletes)
+                        stats.inserted += len(inserts)
+                        stats.deleted += len(deletes)
+            finally:
+                # Batches written before a failure are committed, so the caches are told about them too.
+                if stats.inserted or stats.deleted:
+                    transaction.on_commit(partial(bump_generation, 'instructor_courses'))
+    finally:
+        os.remove(path)
+
+    stats.elapsed = time.perf_counter() - stats.started
+    return stats
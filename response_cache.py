@@ -0,0 +1,115 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from courses.generations import get_generation
+
+
+class LRUCache(object):
+    """
+    Thread safe in-process cache holding at most max_entries values, each for at most timeout seconds.
+    When the cache is full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()  # key -> (expires, value), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def make_etag(data):
+    """
+    Returns a strong, quoted ETag for JSON serializable data.
+    """
+    content = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return '"{0}"'.format(hashlib.md5(content).hexdigest())
+
+
+def etag_matches(etag, if_none_match):
+    """
+    Checks etag against the value of an If-None-Match request header.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        # If-None-Match uses weak comparison, so W/"x" matches "x".
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class SearchResponseCache(LRUCache):
+    """
+    Caches the serialized results of InstructorCoursesList, along with their ETag, by normalized query parameters.
+
+    Every key includes the 'instructor_courses' generation (see generations.py), so saving or deleting an
+     InstructorCourses row invalidates all the cached responses at once; the old entries are never hit again and
+     fall out of the cache as it fills up or expires.
+    """
+
+    def make_key(self, query_params):
+        search_user = query_params.get('search_user', None)
+        search_course = query_params.get('search_course', None)
+        # Searches are case-insensitive, so 'Sean' and 'sean' share an entry.
+        if search_user is not None:
+            search_user = search_user.lower()
+        if search_course is not None:
+            search_course = search_course.lower()
+
+        if 'cursor' in query_params:
+            position = ('cursor', query_params['cursor'])
+        else:
+            # Anything that isn't an integer is served page 1 by the view.
+            try:
+                position = ('page', int(query_params.get('page')))
+            except (TypeError, ValueError):
+                position = ('page', 1)
+
+        return get_generation('instructor_courses'), search_user, search_course, position
+
+    def set(self, key, data):
+        """
+        Caches data under key and returns the cached (etag, data) pair.
+        """
+        value = (make_etag(data), data)
+        super(SearchResponseCache, self).set(key, value)
+        return value
+
+
+search_response_cache = SearchResponseCache(getattr(settings, 'SEARCH_RESPONSE_CACHE_MAX_ENTRIES', 1000),
+                                            getattr(settings, 'SEARCH_RESPONSE_CACHE_TIMEOUT', 60))
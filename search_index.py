@@ -0,0 +1,255 @@
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from courses.models import InstructorCourses
+from courses.generations import get_generation
+from courses.db_routing import use_primary
+
+
+def trigrams(value):
+    """
+    Returns the set of lowercase trigrams (3 character substrings) in value.
+    Strings shorter than 3 characters have no trigrams.
+    """
+    value = value.lower()
+    return set(value[i:i + 3] for i in range(len(value) - 2))
+
+
+class TrigramIndex(object):
+    """
+    In-memory trigram index answering case-insensitive substring searches (the same thing as an icontains filter)
+     over a fixed set of string fields.
+
+    Rows are stored by primary key and results are returned in primary key order. Every search term 3 characters or
+     longer narrows the candidate rows to the ones containing all of its trigrams; the candidates are then checked
+     with a plain substring test, so the results are exactly what icontains would return.
+
+    Searches read an immutable snapshot and never wait for each other or for writers. build() makes a new snapshot,
+     and apply() (and add()/remove()) publish a changed copy of the current one. A copy costs about as much as
+     copying a dict of every row, so changes are best applied in batches.
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        # Only taken by writers, so that two changes can't be applied to the same snapshot.
+        self._lock = threading.Lock()
+        self._snapshot = self._empty()
+
+    def _empty(self):
+        # pk -> {field: value, 'pk': pk}, and one posting dict per field: trigram -> set of pks whose value contains it
+        return {}, dict((field, {}) for field in self.fields)
+
+    def __len__(self):
+        return len(self._snapshot[0])
+
+    def build(self, rows):
+        """
+        Replaces the contents of the index. rows is an iterable of (pk, {field: value}) pairs.
+        """
+        snapshot = self._empty()
+        for pk, row in rows:
+            self._add(snapshot, pk, row, None)
+        with self._lock:
+            self._snapshot = snapshot
+
+    def apply(self, added=(), removed=()):
+        """
+        Adds the (pk, {field: value}) pairs in added, replacing any rows with the same pks, and removes the pks in
+         removed, as one new snapshot.
+        """
+        with self._lock:
+            rows, postings = self._snapshot
+            snapshot = dict(rows), dict((field, dict(field_postings)) for field, field_postings in postings.items())
+            # The (field, trigram) posting sets copied so far; the others are still shared with the old snapshot.
+            copied = set()
+            for pk in removed:
+                self._remove(snapshot, pk, copied)
+            for pk, row in added:
+                self._remove(snapshot, pk, copied)
+                self._add(snapshot, pk, row, copied)
+            self._snapshot = snapshot
+
+    def add(self, pk, row):
+        # Adding a pk that is already indexed replaces the old row, so this also handles updates.
+        self.apply(added=[(pk, row)])
+
+    def remove(self, pk):
+        self.apply(removed=[pk])
+
+    @staticmethod
+    def _pks(postings, field, gram, copied):
+        # Returns the posting set of gram, to be changed. copied is None while building a new snapshot, which shares
+        #  nothing.
+        field_postings = postings[field]
+        pks = field_postings.get(gram)
+        if copied is not None and (field, gram) not in copied:
+            pks = field_postings[gram] = set(pks) if pks is not None else set()
+            copied.add((field, gram))
+        elif pks is None:
+            pks = field_postings[gram] = set()
+        return pks
+
+    def _add(self, snapshot, pk, row, copied):
+        rows, postings = snapshot
+        row = dict((field, row[field]) for field in self.fields)
+        row['pk'] = pk
+        rows[pk] = row
+        for field in self.fields:
+            for gram in trigrams(row[field]):
+                self._pks(postings, field, gram, copied).add(pk)
+
+    def _remove(self, snapshot, pk, copied):
+        rows, postings = snapshot
+        row = rows.pop(pk, None)
+        if row is None:
+            return
+        for field in self.fields:
+            for gram in trigrams(row[field]):
+                if gram in postings[field]:
+                    pks = self._pks(postings, field, gram, copied)
+                    pks.discard(pk)
+                    if not pks:
+                        del postings[field][gram]
+
+    def search(self, **terms):
+        """
+        Returns the rows whose fields contain every given term (case-insensitive), in primary key order. Each row is
+         a dict of the indexed fields and the row's pk. Terms that are None are ignored, so search() with no terms
+         returns every row.
+        """
+        terms = dict((field, term.lower()) for field, term in terms.items() if term is not None)
+        rows, postings = self._snapshot
+
+        candidates = None
+        for field, term in terms.items():
+            grams = trigrams(term)
+            if not grams:
+                # Terms shorter than 3 characters can't narrow anything down; they are only checked below.
+                continue
+            field_postings = postings[field]
+            # Intersecting the smallest posting sets first keeps the working set small.
+            for pks in sorted((field_postings.get(gram, ()) for gram in grams), key=len):
+                candidates = set(pks) if candidates is None else candidates & pks
+                if not candidates:
+                    return []
+
+        if candidates is None:
+            candidates = rows.keys()
+
+        return [rows[pk] for pk in sorted(candidates)
+                if all(term in rows[pk][field].lower() for field, term in terms.items())]
+
+
+class InstructorCoursesIndex(TrigramIndex):
+    """
+    Trigram index over the course_id and instructor_username columns of InstructorCourses.
+
+    The index is loaded from the database the first time it's searched and is patched by the post_save/post_delete
+     signals below after that. Writes made by other processes are picked up when the 'instructor_courses'
+     generation changes (see generations.py; bulk writes like the sync_instructor_courses command bump it
+     themselves): the index is refreshed incrementally, the way the course catalog is, while other threads go on
+     searching the current snapshot. Changes made in place by other processes are picked up by a full reload once
+     the index is older than INSTRUCTOR_COURSES_INDEX_MAX_AGE seconds.
+    """
+
+    def __init__(self):
+        super(InstructorCoursesIndex, self).__init__(('course_id', 'instructor_username'))
+        self._loaded_at = None
+        self._generation = None
+        self._max_pk = 0
+        self._reload_lock = threading.Lock()
+
+    def is_loaded(self):
+        return self._loaded_at is not None
+
+    @staticmethod
+    def _rows(queryset):
+        return ((pk, {'course_id': course_id, 'instructor_username': instructor_username})
+                for pk, course_id, instructor_username in
+                queryset.values_list('pk', 'course_id', 'instructor_username').iterator())
+
+    def reload(self, generation=None):
+        self.build(self._rows(InstructorCourses.objects.all()))
+        self._max_pk = max(self._snapshot[0], default=0)
+        self._generation = generation
+        self._loaded_at = time.time()
+
+    def refresh(self, generation=None):
+        """
+        Brings the index up to date with the fewest queries it can: rows with a primary key above the highest one
+         loaded are fetched and added, and only if the row count then shows rows were deleted are the primary keys
+         fetched to find them. The index is only reloaded if the count still doesn't match.
+        """
+        added = list(self._rows(InstructorCourses.objects.filter(pk__gt=self._max_pk).order_by('pk')))
+        if added:
+            self.apply(added=added)
+            self._max_pk = max(self._max_pk, added[-1][0])
+        if InstructorCourses.objects.count() != len(self):
+            pks = set(InstructorCourses.objects.values_list('pk', flat=True).iterator())
+            self.apply(removed=[pk for pk in self._snapshot[0] if pk not in pks])
+            if len(pks) != len(self):
+                # Rows committed late with a primary key below the highest one loaded.
+                self.reload(generation)
+                return
+        self._generation = generation
+
+    def ensure_loaded(self):
+        max_age = getattr(settings, 'INSTRUCTOR_COURSES_INDEX_MAX_AGE', 300)
+        # The generation is read before the table, so a change made while loading leaves the index out of date.
+        generation = get_generation('instructor_courses')
+        loaded_at = self._loaded_at
+        expired = loaded_at is None or (max_age is not None and time.time() - loaded_at > max_age)
+        if not expired and generation == self._generation:
+            return
+        # Only the first load makes searches wait. After that, one thread brings the index up to date while the
+        #  others go on searching the current snapshot.
+        if not self._reload_lock.acquire(blocking=loaded_at is None):
+            return
+        try:
+            # Another thread may have reloaded the index while this one was waiting for the lock.
+            if self._loaded_at is not loaded_at:
+                return
+            # A replica may not have the changes that bumped the generation yet.
+            with use_primary():
+                if expired:
+                    self.reload(generation)
+                elif generation != self._generation:
+                    self.refresh(generation)
+        finally:
+            self._reload_lock.release()
+
+    def search(self, **terms):
+        self.ensure_loaded()
+        return super(InstructorCoursesIndex, self).search(**terms)
+
+
+instructor_courses_index = InstructorCoursesIndex()
+
+
+# The index is only patched once a change commits, so a rolled back change never reaches it.
+def _add_if_loaded(pk, row):
+    # If the index hasn't been loaded yet, the row will be picked up when it is.
+    if instructor_courses_index.is_loaded():
+        instructor_courses_index.add(pk, row)
+
+
+def _remove_if_loaded(pk):
+    if instructor_courses_index.is_loaded():
+        instructor_courses_index.remove(pk)
+
+
+@receiver(post_save, sender=InstructorCourses, dispatch_uid='instructor_courses_index_save')
+def update_instructor_courses_index(sender, instance, **kwargs):
+    transaction.on_commit(partial(_add_if_loaded, instance.pk, {'course_id': instance.course_id,
+                                                                'instructor_username': instance.instructor_username}))
+
+
+@receiver(post_delete, sender=InstructorCourses, dispatch_uid='instructor_courses_index_delete')
+def remove_from_instructor_courses_index(sender, instance, **kwargs):
+    # The pk is taken now; delete() clears it from the instance before the transaction commits.
+    transaction.on_commit(partial(_remove_if_loaded, instance.pk))
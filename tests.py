@@ -0,0 +1,346 @@
+import datetime
+from operator import itemgetter
+
+from django.core import mail
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.mail.backends.locmem import EmailBackend
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+from courses.models import BbMetaCourses, BbMetaLinkedCourses
+from courses.pagination import encode_cursor, decode_cursor, paginate_by_cursor, posted_page_number, \
+    InvalidCursor
+from courses.search_index import TrigramIndex
+from courses.catalog import CourseCatalog
+from courses.registrar_sync import external_sort, diff
+from courses.response_cache import etag_matches
+from courses.views import latest_term, ChildCourseDecisions
+from courses.notifications import render_decisions, APPROVED, DENIED
+from courses.db_routing import ReplicaRouter, ReplicaRoutingMiddleware, use_primary
+from courses.lms_feed import parse_since
+from courses.dashboard import dashboard_cache, get_user_requested_courses
+from courses.decisions import apply_decisions, InvalidDecision, ENABLED, PENDING, DISABLED
+from courses.outbox import OutboxMessage, deliver_outbox, retry_delay
+
+
+class CursorPaginationTests(SimpleTestCase):
+    key = staticmethod(itemgetter('course_id', 'instructor_username', 'pk'))
+
+    def paginate(self, rows, cursor):
+        return paginate_by_cursor(rows, cursor, 5, key=self.key, position_types=(str, str, int))
+
+    def test_round_trip(self):
+        cursor = encode_cursor('prev', ('15SS_MATH1001', 'sean_s', 7))
+        self.assertEqual(decode_cursor(cursor, (str, str, int)), ('prev', ('15SS_MATH1001', 'sean_s', 7)))
+
+    def test_invalid_cursors(self):
+        for cursor in ('not a cursor', encode_cursor('sideways', ('a', 'b', 1)), encode_cursor('next', (1, None)),
+                       encode_cursor('next', ('a', 'b')), encode_cursor('next', ('a', 'b', 1, 2))):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor, (str, str, int))
+
+    def test_pages_cover_repeated_keys(self):
+        # Every (course_id, instructor_username) pair is in three rows, so some fall on page boundaries.
+        rows = [{'course_id': 'course{0}'.format(i // 3), 'instructor_username': 'sean_s', 'pk': i}
+                for i in range(21)]
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            page = self.paginate(rows, cursor)
+            seen.extend(row['pk'] for row in page.results)
+            cursor = page.next_cursor
+        self.assertEqual(seen, list(range(21)))
+
+        page = self.paginate(rows, encode_cursor('prev', self.key(rows[10])))
+        self.assertEqual([row['pk'] for row in page.results], [5, 6, 7, 8, 9])
+
+
+class PostedPageNumberTests(SimpleTestCase):
+    def test_posted_page_number(self):
+        self.assertEqual(posted_page_number('4'), 4)
+        self.assertEqual(posted_page_number(None), 1)
+        self.assertEqual(posted_page_number('0'), 1)
+        self.assertEqual(posted_page_number('x'), 1)
+
+
+class TrigramIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = TrigramIndex(('course_id', 'instructor_username'))
+        self.index.build([(3, {'course_id': '15FS_MATH1001', 'instructor_username': 'sean_s'}),
+                          (1, {'course_id': '15FS_ENGL1001', 'instructor_username': 'jane_d'}),
+                          (2, {'course_id': '15SS_MATH2002', 'instructor_username': 'Sean_T'})])
+
+    def pks(self, **terms):
+        return [row['pk'] for row in self.index.search(**terms)]
+
+    def test_case_insensitive_substring(self):
+        self.assertEqual(self.pks(course_id='math'), [2, 3])
+        self.assertEqual(self.pks(course_id='math', instructor_username='SEAN_S'), [3])
+        self.assertEqual(self.pks(course_id='1001'), [1, 3])
+
+    def test_short_and_missing_terms(self):
+        self.assertEqual(self.pks(), [1, 2, 3])
+        self.assertEqual(self.pks(course_id=None, instructor_username='_t'), [2])
+        self.assertEqual(self.pks(course_id='HIST'), [])
+
+    def test_add_and_remove(self):
+        self.index.add(4, {'course_id': '16SS_MATH1001', 'instructor_username': 'sean_s'})
+        self.index.add(3, {'course_id': '15FS_HIST1001', 'instructor_username': 'sean_s'})
+        self.index.remove(2)
+        self.assertEqual(self.pks(course_id='math'), [4])
+        self.assertEqual(self.pks(course_id='hist'), [3])
+        self.assertEqual(len(self.index), 3)
+
+    def test_changes_leave_earlier_snapshots_alone(self):
+        rows, postings = self.index._snapshot
+        self.index.apply(added=[(4, {'course_id': '16SS_MATH1001', 'instructor_username': 'sean_s'})], removed=[3])
+        self.assertEqual(sorted(rows), [1, 2, 3])
+        self.assertEqual(postings['course_id']['mat'], set([2, 3]))
+        self.assertEqual(self.pks(course_id='math'), [2, 4])
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('"abc"', '"abc"'))
+        self.assertTrue(etag_matches('"abc"', 'W/"xyz", W/"abc"'))
+        self.assertTrue(etag_matches('"abc"', '*'))
+        self.assertFalse(etag_matches('"abc"', '"xyz"'))
+        self.assertFalse(etag_matches('"abc"', None))
+
+
+class LatestTermTests(SimpleTestCase):
+    def test_latest_term(self):
+        self.assertEqual(latest_term(['15SS_MATH1001', '15FS_MATH1001', '15US_MATH1001']), '15FS')
+        self.assertEqual(latest_term(['15FS_MATH1001', '16SS_MATH1001']), '16SS')
+        self.assertEqual(latest_term([]), '00ZZ')
+
+
+class RenderDecisionsTests(SimpleTestCase):
+    def test_single_decision(self):
+        subject, message = render_decisions([[APPROVED, '15FS_MATH1001']])
+        self.assertIn('Approved', subject)
+        self.assertIn('15FS_MATH1001 has been approved', message)
+
+    def test_several_decisions(self):
+        subject, message = render_decisions([[APPROVED, '15FS_MATH1001'], [DENIED, '15FS_ENGL1001']])
+        self.assertIn('2 Of Your Requests', subject)
+        self.assertLess(message.index('approved'), message.index('15FS_MATH1001'))
+        self.assertLess(message.index('denied'), message.index('15FS_ENGL1001'))
+
+
+class RegistrarSyncTests(SimpleTestCase):
+    def test_external_sort(self):
+        items = [(str(i % 7), i) for i in range(50)]
+        self.assertEqual(list(external_sort(iter(items), 8)), sorted(items))
+        self.assertEqual(list(external_sort(iter([]), 8)), [])
+
+    def test_diff(self):
+        feed = [('a', 'x'), ('b', 'x'), ('b', 'x'), ('d', 'x')]
+        existing = [('a', 'x', 1), ('a', 'x', 2), ('c', 'x', 3), ('d', 'x', 4)]
+        self.assertEqual(list(diff(feed, existing)),
+                         [('delete', 2), ('insert', ('b', 'x')), ('delete', 3)])
+        self.assertEqual(list(diff([], existing)), [('delete', 1), ('delete', 2), ('delete', 3), ('delete', 4)])
+
+
+class ApplyDecisionsTests(TestCase):
+    def setUp(self):
+        meta = BbMetaCourses.objects.create(instructor_id='jane_d', meta_course_id='meta_jane_d_1',
+                                            meta_course_name='(Meta 15F) Test Meta Course (001, 002)')
+        self.links = [BbMetaLinkedCourses.objects.create(meta_course_pk1=meta, child_course=child_course,
+                                                         requestor='jane_d', child_course_instructor='sean_s',
+                                                         row_status=PENDING)
+                      for child_course in ('15FS_MATH1001', '15FS_MATH1002')]
+
+    def row_statuses(self):
+        return [link.row_status for link in BbMetaLinkedCourses.objects.order_by('pk')]
+
+    def test_decides_pending_requests(self):
+        self.assertEqual(apply_decisions('sean_s', [(self.links[0].pk, ENABLED), (self.links[1].pk, DISABLED)]), 2)
+        self.assertEqual(self.row_statuses(), [ENABLED, DISABLED])
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_invalid_row_statuses(self):
+        for row_status in (3, -1, False, 0.0, '0', None):
+            with self.assertRaises(InvalidDecision):
+                apply_decisions('sean_s', [(self.links[0].pk, row_status)])
+        self.assertEqual(self.row_statuses(), [PENDING, PENDING])
+
+    def test_nothing_is_changed_unless_every_decision_is_valid(self):
+        other = BbMetaLinkedCourses.objects.create(meta_course_pk1=self.links[0].meta_course_pk1,
+                                                   child_course='15FS_ENGL1001', requestor='jane_d',
+                                                   child_course_instructor='bob_b', row_status=PENDING)
+        with self.assertRaises(InvalidDecision):
+            apply_decisions('sean_s', [(self.links[0].pk, ENABLED), (other.pk, ENABLED)])
+        self.assertEqual(self.row_statuses(), [PENDING, PENDING, PENDING])
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_redeciding_a_request_is_rejected(self):
+        view = ChildCourseDecisions.as_view()
+        factory = APIRequestFactory()
+
+        def post(row_status):
+            return view(factory.post('/', {'decisions': [{'pk': self.links[0].pk, 'row_status': row_status}]},
+                                     format='json'))
+
+        response = post(ENABLED)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'decided': 1})
+        self.assertEqual(post(DISABLED).status_code, 400)
+        self.assertEqual(self.row_statuses(), [ENABLED, PENDING])
+
+
+@override_settings(COURSES_READ_REPLICAS=['replica'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def view(self, request):
+        # Records where the view's reads would go.
+        return HttpResponse(self.router.db_for_read(BbMetaLinkedCourses))
+
+    def test_router(self):
+        self.assertEqual(self.router.db_for_read(BbMetaLinkedCourses), 'replica')
+        self.assertEqual(self.router.db_for_write(BbMetaLinkedCourses), 'default')
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(BbMetaLinkedCourses), 'default')
+        self.assertEqual(self.router.db_for_read(BbMetaLinkedCourses), 'replica')
+        self.assertFalse(self.router.allow_migrate('replica', 'courses'))
+        self.assertTrue(self.router.allow_migrate('default', 'courses'))
+
+    def test_unsafe_requests_stick_to_the_primary(self):
+        middleware = ReplicaRoutingMiddleware(self.view)
+        response = middleware(self.factory.get('/status/'))
+        self.assertEqual(response.content, b'replica')
+        self.assertNotIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+
+        response = middleware(self.factory.post('/status/'))
+        self.assertEqual(response.content, b'default')
+        self.assertIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+
+        request = self.factory.get('/status/')
+        request.COOKIES[ReplicaRoutingMiddleware.cookie_name] = '1'
+        self.assertEqual(middleware(request).content, b'default')
+        # The setting doesn't outlive the request.
+        self.assertEqual(self.router.db_for_read(BbMetaLinkedCourses), 'replica')
+
+    async def test_async_requests(self):
+        async def view(request):
+            return self.view(request)
+
+        middleware = ReplicaRoutingMiddleware(view)
+        self.assertEqual((await middleware(self.factory.get('/status/'))).content, b'replica')
+        response = await middleware(self.factory.post('/status/'))
+        self.assertEqual(response.content, b'default')
+        self.assertIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+
+    @override_settings(COURSES_READ_REPLICAS=[])
+    def test_unused_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(BbMetaLinkedCourses), 'default')
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(self.view)
+
+
+class ParseSinceTests(SimpleTestCase):
+    def test_parse_since(self):
+        self.assertIsNone(parse_since(None))
+        self.assertEqual(parse_since('2015-08-01T12:00:00+00:00').isoformat(), '2015-08-01T12:00:00+00:00')
+        self.assertTrue(timezone.is_aware(parse_since('2015-08-01T12:00:00')))
+        for value in ('yesterday', '2015-13-01T12:00:00'):
+            with self.assertRaises(ValueError):
+                parse_since(value)
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise OSError('Connection refused')
+
+
+@override_settings(OUTBOX_RETRY_DELAY=60, OUTBOX_MAX_RETRY_DELAY=3600)
+class DeliverOutboxTests(TestCase):
+    def queue(self, **kwargs):
+        return OutboxMessage.objects.create(subject='Subject', body='Body', from_email='from@example.com',
+                                            recipients='sean_s@example.com', **kwargs)
+
+    def test_sends_due_messages(self):
+        message = self.queue()
+        self.queue(send_after=timezone.now() + datetime.timedelta(minutes=5))
+        self.queue(claimed_until=timezone.now() + datetime.timedelta(minutes=5))
+        # A claim that has run out is taken to be from a worker that died.
+        expired = self.queue(claimed_until=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(deliver_outbox(), (2, 0))
+        self.assertEqual([email.to for email in mail.outbox], [['sean_s@example.com']] * 2)
+
+        sent = OutboxMessage.objects.filter(sent_at__isnull=False).order_by('pk')
+        self.assertEqual(list(sent), [message, expired])
+        self.assertFalse(sent.filter(claimed_until__isnull=False).exists())
+        self.assertEqual(deliver_outbox(), (0, 0))
+
+    def test_failed_messages_are_retried_with_backoff(self):
+        message = self.queue()
+        self.assertEqual(deliver_outbox(connection=FailingEmailBackend()), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('Connection refused', message.last_error)
+        self.assertIsNone(message.claimed_until)
+        self.assertAlmostEqual((message.send_after - timezone.now()).total_seconds(), 60, delta=5)
+
+        # Not due again until the backoff has passed.
+        self.assertEqual(deliver_outbox(), (0, 0))
+        OutboxMessage.objects.update(send_after=timezone.now())
+        self.assertEqual(deliver_outbox(connection=FailingEmailBackend()), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 2)
+        self.assertAlmostEqual((message.send_after - timezone.now()).total_seconds(), 120, delta=5)
+
+        OutboxMessage.objects.update(send_after=timezone.now())
+        self.assertEqual(deliver_outbox(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        self.queue(attempts=3)
+        self.assertEqual(deliver_outbox(max_attempts=3), (0, 0))
+        self.assertEqual(deliver_outbox(max_attempts=4), (1, 0))
+
+    def test_retry_delay(self):
+        self.assertEqual([retry_delay(attempts) for attempts in (1, 2, 3)], [60, 120, 240])
+        self.assertEqual(retry_delay(20), 3600)
+
+
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        dashboard_cache.clear()
+        meta = BbMetaCourses.objects.create(instructor_id='jane_d', meta_course_id='meta_jane_d_1',
+                                            meta_course_name='(Meta 15F) Test Meta Course (001, 002)')
+        self.link = BbMetaLinkedCourses.objects.create(meta_course_pk1=meta, child_course='15FS_MATH1001',
+                                                       requestor='jane_d', child_course_instructor='sean_s',
+                                                       row_status=PENDING)
+
+    def test_cached_page_holds_its_rows(self):
+        page, grouped = get_user_requested_courses('jane_d', 1, 50)
+        self.assertIs(get_user_requested_courses('jane_d', 1, 50)[0], page)
+        with self.assertNumQueries(0):
+            self.assertEqual([course['child_course'] for course in page], ['15FS_MATH1001'])
+            self.assertFalse(page.has_next())
+
+    def test_another_instructors_decision_invalidates_the_requestors_page(self):
+        page, grouped = get_user_requested_courses('jane_d', 1, 50)
+        self.assertEqual(list(grouped), ['(Meta 15F) Test Meta Course (001, 002)'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_decisions('sean_s', [(self.link.pk, ENABLED)])
+
+        page, grouped = get_user_requested_courses('jane_d', 1, 50)
+        self.assertEqual(page.object_list, [])
+        self.assertEqual(grouped, {})
+
+
+class CourseCatalogTests(SimpleTestCase):
+    def test_rows_of_a_course_stay_in_primary_key_order(self):
+        catalog = CourseCatalog()
+        for pk, course_id, instructor_username in ((5, '15FS_MATH1001', 'jane_d'), (9, '15FS_ENGL1001', 'bob_b'),
+                                                   (2, '15FS_MATH1001', 'sean_s'), (7, '15FS_MATH1001', 'bob_b')):
+            catalog.add(pk, course_id, instructor_username)
+        self.assertEqual(list(catalog._row_pks), [9, 2, 5, 7])
+        self.assertEqual(catalog._instructor_of('15FS_MATH1001'), 'sean_s')
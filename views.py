@@ -1,55 +1,131 @@
-from django.shortcuts import HttpResponseRedirect, render
+from functools import wraps
+from operator import itemgetter
+
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import HttpResponseRedirect
 from django.views.generic import CreateView
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.core.mail import send_mass_mail
-from django.forms import formset_factory
+from django.db import transaction
+from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from courses.models import BbMetaCourses, BbMetaLinkedCourses, InstructorCourses
+from rest_framework import status
+from courses.models import BbMetaLinkedCourses
 from courses.serializers import InstructorCoursesSerializer
+from courses.search_index import instructor_courses_index
+from courses.catalog import course_catalog
+from courses.pagination import paginate_by_cursor, InvalidCursor, get_page, page_prefix, page_url, posted_pks, \
+    posted_page_number
+from courses.response_cache import search_response_cache, etag_matches
+from courses.outbox import enqueue_digest
+from courses.notifications import APPROVAL_REQUESTS, user_email
+from courses.decisions import apply_decisions, InvalidDecision, ROW_STATUSES, PENDING
+from courses.instrumentation import render, timed, timing_stats
+from courses.dashboard import get_user_meta_courses, get_add_link_formset_class, get_user_requested_courses, \
+    invalidate_users
+from courses.lms_feed import FEED_CONTENT_TYPES, feed_lines, parse_since, record_link_changes
 from courses.forms import MetaCoursesForm, UserLinkedCoursesFormSet, ForeignLinkedCoursesFormSet, \
-    UpdateMetaLinkedCoursesFormset, RemoveMetaLinkedCoursesFormset, create_add_link_form
+    UpdateMetaLinkedCoursesFormset, RemoveMetaLinkedCoursesFormset
 
 
 class InstructorCoursesList(APIView):
-	"""
-	Uses Django Rest Framework to allow intructors to dynamically search for courses based on instructor ID
-	or course ID, and paginates the results.
-	"""
-	
-    # I'm not sure if it would be more efficient to use pagination or simply slice the result list 
-    # (e.g. having [:15] at the end of the query). Might not matter because QuerySets are lazy 
-    # (query is actually run when QuerySet is evaluated). Will need to investigate this sometime.
+    """
+    Uses Django Rest Framework to allow intructors to dynamically search for courses based on instructor ID
+    or course ID, and paginates the results.
+    """
+
+    # Responses are cached by their normalized query parameters and carry an ETag, so repeated searches skip the
+    #  search and serialization entirely, and browsers revalidating a search they already have get a 304.
     def get(self, request, format=None):
-        search_user = request.query_params.get('search_user', None)
-        search_course = request.query_params.get('search_course', None)
-
-        if (search_user and search_course) is not None:
-            instructorcourse_list = InstructorCourses.objects.filter(instructor_username__icontains=search_user,
-                                                                     course_id__icontains=search_course)\
-															 .values('course_id', 'instructor_username')
-        elif search_user is not None:
-            instructorcourse_list = InstructorCourses.objects.filter(instructor_username__icontains=search_user)\
-															 .values('course_id', 'instructor_username')
-        elif search_course is not None:
-            instructorcourse_list = InstructorCourses.objects.filter(course_id__icontains=search_course)\
-															 .values('course_id', 'instructor_username')
-        
+        status_code, etag, data = self.cached_search(request.query_params)
+        if status_code != status.HTTP_200_OK:
+            return Response(data, status=status_code)
+
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(data, headers=headers)
+
+    @classmethod
+    def cached_search(cls, query_params):
+        """
+        Returns (status_code, etag, data) for a search; etag is None for errors. Shared with the async search view.
+        """
+        cache_key = search_response_cache.make_key(query_params)
+        cached = search_response_cache.get(cache_key)
+        if cached is None:
+            status_code, data = cls.search(query_params)
+            if status_code != status.HTTP_200_OK:
+                return status_code, None, data
+            cached = search_response_cache.set(cache_key, data)
+        etag, data = cached
+        return status.HTTP_200_OK, etag, data
+
+    # Searches are answered from an in-memory trigram index instead of icontains filters, which the database can
+    #  only run as full table scans (LIKE '%x%'). See search_index.py.
+    @staticmethod
+    def search(query_params):
+        """
+        Returns (status_code, data) for a search.
+        """
+        search_user = query_params.get('search_user', None)
+        search_course = query_params.get('search_course', None)
+
+        # Either search term may be left out; a term that is None isn't filtered on.
+        instructorcourse_list = instructor_courses_index.search(instructor_username=search_user,
+                                                                course_id=search_course)
+
+        # Cursor mode: clients that send a cursor parameter (empty for the first page) get keyset pagination
+        #  ordered on (course_id, instructor_username, pk), with opaque next/prev cursors instead of page numbers.
+        #  The same course and instructor can be in more than one row, so the pk keeps the keys unique.
+        if 'cursor' in query_params:
+            try:
+                cursor_page = paginate_by_cursor(instructorcourse_list, query_params['cursor'], 15,
+                                                 key=itemgetter('course_id', 'instructor_username', 'pk'),
+                                                 position_types=(str, str, int))
+            except InvalidCursor:
+                return status.HTTP_400_BAD_REQUEST, {'detail': 'Invalid cursor.'}
+            with timed('serialize'):
+                data = InstructorCoursesSerializer(cursor_page.results, many=True).data
+            return status.HTTP_200_OK, {'results': data,
+                                        'next': cursor_page.next_cursor,
+                                        'prev': cursor_page.prev_cursor}
+
         paginator = Paginator(instructorcourse_list, 15)
-        page = request.query_params.get('page')
+        page = query_params.get('page')
         try:
             instructorcourses = paginator.page(page)
         except PageNotAnInteger:
             # If page is not an integer, deliver first page.
             instructorcourses = paginator.page(1)
+        except EmptyPage:
+            # If page is out of range, deliver no results and let javascript handle the 'next' button being
+            #  out of range.
+            instructorcourses = []
+
+        with timed('serialize'):
+            data = InstructorCoursesSerializer(instructorcourses, many=True).data
+        return status.HTTP_200_OK, data
 
-        # Removing lines below to allow javascript to handle if the 'next' button is out of range
-        #  for displaying the results.
-        # except EmptyPage:
-        #    # If page is out of range, deliver last page of results
-        #    instructorcourses = paginator.page(paginator.num_pages)
-        serializer = InstructorCoursesSerializer(instructorcourses, many=True)
-        return Response(serializer.data)
+
+def latest_term(course_ids):
+    """
+    Returns the most recent term of the given course_ids, i.e. the first 4 characters of a course_id.
+    Within a year, fall (F) is later than summer (U), which is later than spring (S).
+    Returns '00ZZ' if there are no course_ids.
+    """
+    current_term = '00ZZ'
+    for course_id in course_ids:
+        term = course_id[:4]
+        if term[:2] > current_term[:2]:
+            current_term = term
+        elif term[:2] == current_term[:2]:
+            if term[2] == 'F' and (current_term[2] == 'U' or current_term[2] == 'S'):
+                current_term = term
+            elif term[2] == 'U' and current_term[2] == 'S':
+                current_term = term
+    return current_term
 
 
 class CreateMetaCourse(CreateView):
@@ -73,8 +149,7 @@ class CreateMetaCourse(CreateView):
         # username = request.META['cn']  # 'cn' could also be replaced with 'REMOTE_USER'
 		
         username = 'sean_s'  # FOR TESTING ONLY
-        user_courses_list = InstructorCourses.objects.filter(instructor_username=username)\
-            .values_list('course_id', flat=True).order_by('course_id')
+        user_courses_list = course_catalog.courses_of(username)
 
         return self.render_to_response(self.get_context_data(form=form,
                                                              user_courses_formset=user_courses_formset,
@@ -105,121 +180,114 @@ class CreateMetaCourse(CreateView):
         # e.g. form.send_email()
         #       return super(CreateMetaCourse, self).form.valid(form)
 
-        # save(commit=False) returns an object that hasn't yet been saved to the database,
-        # so we can do some processing before saving
-        new_metacourse = form.save(commit=False)
-
-        new_metacourse.instructor_id = username
-        new_metacourse.meta_course_name = form.cleaned_data['meta_course_name'] + ' ' + '(' \
-                                          + form.cleaned_data['sections'] + ')'
-        new_metacourse.meta_course_id = 'meta_' + username + '_' + 'temp'
-        new_metacourse.save()
-        # First the instance has to be saved so a pk will be created,
-        # then the meta_course_id is changed to include it.
-        new_metacourse.meta_course_id = 'meta_' + username + '_' + str(new_metacourse.pk1)
-        # Instance will be saved again below
+        # This kind of verification should probably be in an overridden clean() function in the form class
+        #  declaration, but this just an easy/straightforward solution.
+        # Only the foreign course forms that have changed are used, so that blank forms are not saved to the database.
+        foreign_course_forms = [course_form for course_form in foreign_courses_formset if course_form.has_changed()]
+        submitted_courses = [course_form.cleaned_data['child_course']
+                             for course_form in list(user_courses_formset) + foreign_course_forms]
 
-        current_term = '00ZZ'
+        # Look up every submitted child course and its instructor in the course catalog, instead of querying the
+        #  database once per form. Only submitted course_ids that exist in the db are linked.
+        child_instructors = course_catalog.instructors_of(submitted_courses)
 
+        course_links = []
         for course_form in user_courses_formset:
-            # Process each form in the formset by adding/changing the appropriate fields
-            # and saving the new database instance.
-
-            # If the submitted course_id exists in the db, then save the rest of the form
-            # This kind of verification should probably be in an overridden clean() function in the form class
-            #  declaration, but this just an easy/straightforward solution.
-            child_course_exists = InstructorCourses.objects\
-                .filter(course_id=course_form.cleaned_data['child_course']).exists()
-            if child_course_exists:
+            if course_form.cleaned_data['child_course'] in child_instructors:
                 course_link = course_form.save(commit=False)
-                # Because meta_course_pk1 is a foreign key, it must be set to the new MetaCourse instance itself,
-                # instead of just its pk1 field (i.e. new_metacourse instead of new_metacourse.pk1)
-                course_link.meta_course_pk1 = new_metacourse
                 course_link.requestor = username
                 course_link.child_course_instructor = username
                 course_link.row_status = 0  # Enabled
-                course_link.save()
-
-                # This block is for finding the most recent term from the course_ids
-                term = course_link.child_course[:4]
-                if term[:2] > current_term[:2]:
-                    current_term = term
-                elif term[:2] == current_term[:2]:
-                    if term[2] == 'F' and (current_term[2] == 'U' or current_term[2] == 'S'):
-                        current_term = term
-                    elif term[2] == 'U' and current_term[2] == 'S':
-                        current_term = term
-
-        email_recipients = {}  # Add instructor usernames as keys to this dict.
-        email_subject = '[BB Meta Courses] New Request for Approval'
-        email_message = 'An instructor has requested to use one of your courses in a Meta Course. ' \
-                        + 'Please visit [URL REMOVED FROM PUBLIC CODE] to approve or deny this request. ' \
-                        + 'If you have any questions or concerns, please contact the IT@UC Help Desk by ' \
-                        + 'telephone at 513-556-HELP (4357) or by email at helpdesk@uc.edu.'
-
-        for course_form in foreign_courses_formset:
-            # This 'if' check assures that blank forms are not saved to the database
-            if course_form.has_changed():
-
-                # If the submitted course_id exists in the db, then save the rest of the form
-                # This kind of verification should probably be in an overridden clean() function in the form class
-                #  declaration, but this just an easy/straightforward solution.
-                child_instructor = InstructorCourses.objects\
-                    .filter(course_id=course_form.cleaned_data['child_course'])\
-                    .values('instructor_username')
-                if child_instructor:
-                    course_link = course_form.save(commit=False)
-                    course_link.meta_course_pk1 = new_metacourse
-                    course_link.requestor = username
-                    course_link.child_course_instructor = child_instructor[0]['instructor_username']
-                    course_link.row_status = 1  # Pending
-                    course_link.save()
+                course_links.append(course_link)
 
-                    # Find the most recent term from the course_ids
-                    term = course_link.child_course[:4]
-                    if term[:2] > current_term[:2]:
-                        current_term = term
-                    elif term[:2] == current_term[:2]:
-                        if term[2] == 'F' and (current_term[2] == 'U' or current_term[2] == 'S'):
-                            current_term = term
-                        elif term[2] == 'U' and current_term[2] == 'S':
-                            current_term = term
-
-                    # Create email message that will be sent to instructors
-                    foreign_instructor = course_link.child_course_instructor
-                    if foreign_instructor not in email_recipients.keys():
-                        # If the foreign_instructor isn't already a key in email_recipients,
-                        #  add it along with its message.
-                        foreign_instructor_email = foreign_instructor + '@ucmail.uc.edu'
-                        # All messages must be in the format (subject, message, from_email, recipient_list)
-                        email_recipients[foreign_instructor] = (email_subject, email_message, 'EMAIL REMOVED',
-                                                                [foreign_instructor_email])
-
-        new_metacourse.meta_course_name = '(Meta ' + current_term + ') ' + new_metacourse.meta_course_name
-        self.object = new_metacourse  # self.object is a parameter of get_success_url, and cannot be None
-        new_metacourse.save()
+        # The courses that need approval, grouped by their instructor so that each instructor gets one email.
+        approval_requests = {}
 
-        # Prepare all the emails for sending. all_messages must be in the format (message1, message2, ...)
-        all_messages = ()
-        for recipient in email_recipients.keys():
-            all_messages = all_messages + (email_recipients[recipient],)
+        for course_form in foreign_course_forms:
+            child_instructor = child_instructors.get(course_form.cleaned_data['child_course'])
+            if child_instructor is not None:
+                course_link = course_form.save(commit=False)
+                course_link.requestor = username
+                course_link.child_course_instructor = child_instructor
+                course_link.row_status = 1  # Pending
+                course_links.append(course_link)
+                approval_requests.setdefault(child_instructor, []).append(course_link.child_course)
+
+        # The meta course name includes the most recent term of its child courses, which is known before anything
+        #  is saved, so the meta course only has to be inserted once.
+        current_term = latest_term(course_link.child_course for course_link in course_links)
+
+        with transaction.atomic():
+            # save(commit=False) returns an object that hasn't yet been saved to the database,
+            # so we can do some processing before saving
+            new_metacourse = form.save(commit=False)
+            new_metacourse.instructor_id = username
+            new_metacourse.meta_course_name = '(Meta ' + current_term + ') ' + form.cleaned_data['meta_course_name'] \
+                                              + ' ' + '(' + form.cleaned_data['sections'] + ')'
+            new_metacourse.meta_course_id = 'meta_' + username + '_' + 'temp'
+            new_metacourse.save()
+            # First the instance has to be saved so a pk will be created,
+            # then the meta_course_id is changed to include it. Only that column needs to be written again.
+            new_metacourse.meta_course_id = 'meta_' + username + '_' + str(new_metacourse.pk1)
+            new_metacourse.save(update_fields=['meta_course_id'])
+
+            for course_link in course_links:
+                # Because meta_course_pk1 is a foreign key, it must be set to the new MetaCourse instance itself,
+                # instead of just its pk1 field (i.e. new_metacourse instead of new_metacourse.pk1)
+                course_link.meta_course_pk1 = new_metacourse
+            # All the links are inserted with one query. bulk_create doesn't send signals, so the cached pages of
+            #  everyone the links show up for are invalidated, and the new links recorded for the LMS feed, here.
+            BbMetaLinkedCourses.objects.bulk_create(course_links)
+            invalidate_users([username] + list(approval_requests.keys()))
+            record_link_changes(course_links)
 
-        send_mass_mail(all_messages, fail_silently=False)
+            # The emails are queued in the same transaction as the meta course and sent by the deliver_outbox
+            #  command, so a slow or unreachable mail server can't hold up or fail the request.
+            for instructor, course_ids in approval_requests.items():
+                enqueue_digest(APPROVAL_REQUESTS, user_email(instructor), course_ids)
+
+        self.object = new_metacourse  # self.object is a parameter of get_success_url, and cannot be None
 
         return HttpResponseRedirect(self.get_success_url())
 
     def form_invalid(self, username, form, user_courses_formset, foreign_courses_formset):
-        user_courses_list = InstructorCourses.objects.filter(instructor_username=username)\
-            .values_list('course_id', flat=True).order_by('course_id')
+        user_courses_list = course_catalog.courses_of(username)
         return self.render_to_response(self.get_context_data(form=form,
                                                              user_courses_formset=user_courses_formset,
                                                              foreign_courses_formset=foreign_courses_formset,
                                                              user_courses_list=user_courses_list))
 
 
+def atomic_unless_safe(view):
+    """
+    Runs a function-based view in a transaction for every request method except GET and HEAD. Those only read, so
+     they don't keep a transaction open on the primary while the page renders.
+    """
+    atomic_view = transaction.atomic(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        return atomic_view(request, *args, **kwargs)
+    return wrapper
+
+
+def pending_links_for(username):
+    # Requests from other instructors to use the user's courses, that are awaiting the user's approval.
+    return BbMetaLinkedCourses.objects.filter(row_status=1).filter(child_course_instructor=username).order_by('pk')
+
+
+def enabled_links_for(username):
+    # Child courses the user has linked to their meta courses, that are enabled.
+    return BbMetaLinkedCourses.objects.filter(row_status=0).filter(requestor=username).order_by('pk')
+
+
 # Sometimes making a function-based view is easier/more straightforward than using class-based.
 # This is one of those cases, as we're dealing with formsets and multiple, existing database instances - something that
 #  would prove to be tricky and complex using class-based views.
+# Each POST runs in a single transaction, so the emails it queues are only saved along with its changes.
+@atomic_unless_safe
 def approve_child_course(request):
     """
     Displays the child courses of the user's meta courses that are awaiting approval from other instructors,
@@ -230,176 +298,208 @@ def approve_child_course(request):
     # username = request.META['cn']  # 'cn' could also be replaced with 'REMOTE_USER'
 	
     username = 'sean_s'  # FOR TESTING ONLY
-    user_requested_courses_raw = BbMetaLinkedCourses.objects.filter(requestor=username).filter(row_status=1)\
-        .values('meta_course_pk1__meta_course_name', 'child_course', 'child_course_instructor')
+    page_size = getattr(settings, 'FORMSET_PAGE_SIZE', 50)
+
     # Courses the user has requested to be added to any meta course they created, that are awaiting approval.
-    user_requested_courses = {}
-    for course in user_requested_courses_raw:
-        meta_name = course['meta_course_pk1__meta_course_name']
-        if meta_name not in user_requested_courses.keys():
-            user_requested_courses[meta_name] = [{'child_course': course['child_course'],
-                                                 'child_course_instructor': course['child_course_instructor']}]
-        else:
-            user_requested_courses[meta_name].append({'child_course': course['child_course'],
-                                                      'child_course_instructor': course['child_course_instructor']})
+    # They're shown a page at a time, grouped by meta course, and cached until one of the user's links changes.
+    requested_page, user_requested_courses = get_user_requested_courses(username, request.GET.get('requested_page'),
+                                                                        page_size)
+
+    # Requests from other instructors to use the user's courses are also shown a page at a time. Each page's formset
+    #  has its own prefix, and the page number is sent back with the POST.
+    page_number = posted_page_number(request.POST.get('page', request.GET.get('page')))
+    pending_links = pending_links_for(username)
+    pending_page = get_page(pending_links, page_number, page_size)
 
     if request.method == 'GET':
-        formset = UpdateMetaLinkedCoursesFormset(queryset=BbMetaLinkedCourses.objects.filter(row_status=1)
-                                                 .filter(child_course_instructor=username))
+        formset = UpdateMetaLinkedCoursesFormset(queryset=pending_page.object_list,
+                                                 prefix=page_prefix('form', pending_page.number))
 
-        context = {'formset': formset, 'user_requested_courses': user_requested_courses}
+        context = {'formset': formset, 'pending_page': pending_page,
+                   'user_requested_courses': user_requested_courses, 'requested_page': requested_page}
 
         return render(request, 'courses/status.html', context)
 
     if request.method == 'POST':
-        formset = UpdateMetaLinkedCoursesFormset(request.POST)
-
-        # Add instructor usernames as keys to this dict.
-        email_recipients = {}
-
+        # The prefix comes from the posted page number, which may be past the last page by now if other requests
+        #  were decided in the meantime; the posted rows are still looked up by their primary keys.
+        prefix = page_prefix('form', page_number)
+        # Only the posted rows are loaded, instead of the formset's default of every BbMetaLinkedCourses row.
+        formset = UpdateMetaLinkedCoursesFormset(request.POST, prefix=prefix,
+                                                 queryset=pending_links.filter(pk__in=posted_pks(request.POST, prefix,
+                                                                                                 BbMetaLinkedCourses)))
+        context = {'formset': formset, 'pending_page': pending_page,
+                   'user_requested_courses': user_requested_courses, 'requested_page': requested_page}
+
+        # Every form is checked before anything is saved, so an invalid form no longer leaves the forms before it
+        #  saved and the ones after it unsaved. A missing or tampered management form is an error too, rather than
+        #  a formset with no forms.
+        if not formset.is_valid():
+            return render(request, 'courses/status.html', context)
+
+        decisions = []
         for form in formset:
-            if form.is_valid():
-                linked_course = form.save(commit=False)
-                row_status = linked_course.row_status
-                child_course = linked_course.child_course
-                requestor = linked_course.requestor
-                requestor_email = requestor + '@ucmail.uc.edu'
-
-                # If the user didn't select approve or deny for a course and submits, then the row_status field's value
-                #  will be an empty string. When that happens, we need to make sure the instance's row_status remains
-                #  at 1 (pending status).
-                if (row_status != 0) and (row_status != 1) and (row_status != 2):
-                    linked_course.row_status = 1
-
-                elif row_status == 0:
-                    email_subject = '[BB Meta Courses] One Of Your Requests Has Been Approved'
-                    # Message contains the ID of the child course that was approved.
-                    email_message = 'Your request to use {0} has been approved. '.format(child_course) + 'If you ' \
-                                    + 'have any questions or concerns, please contact the IT@UC Help Desk by ' \
-                                    + 'telephone at 513-556-HELP (4357) or by email at helpdesk@uc.edu.'
-                    # Create approved email
-                    if requestor in email_recipients.keys():
-                        email_recipients[requestor] = email_recipients[requestor] + ((email_subject, email_message,
-                                                                                      'EMAIL REMOVED',
-                                                                                      [requestor_email]),)
-                    else:
-                        email_recipients[requestor] = ((email_subject, email_message,
-                                                        'EMAIL REMOVED', [requestor_email]),)
-
-                elif row_status == 2:
-                    email_subject = '[BB Meta Courses] One Of Your Requests Has Been Denied'
-                    # Message contains the ID of the child course that was denied.
-                    email_message = 'Your request to use {0} has been Denied. '.format(child_course) + 'If you ' \
-                                    + 'have any questions or concerns, please contact the IT@UC Help Desk by ' \
-                                    + 'telephone at 513-556-HELP (4357) or by email at helpdesk@uc.edu.'
-                    # Create denied email
-                    if requestor in email_recipients.keys():
-                        email_recipients[requestor] = email_recipients[requestor] + ((email_subject, email_message,
-                                                                                      'EMAIL REMOVED',
-                                                                                      [requestor_email]),)
-                    else:
-                        email_recipients[requestor] = ((email_subject, email_message,
-                                                        'EMAIL REMOVED', [requestor_email]),)
+            linked_course = form.save(commit=False)
+            if linked_course.pk is None:
+                continue
+            row_status = linked_course.row_status
+
+            # If the user didn't select approve or deny for a course and submits, then the row_status field's value
+            #  will be an empty string. When that happens, we need to make sure the instance's row_status remains
+            #  at 1 (pending status).
+            if row_status not in ROW_STATUSES:
+                row_status = PENDING
+            decisions.append((linked_course.pk, row_status))
+
+        # The decisions are saved the same way as the ones sent to ChildCourseDecisions.
+        try:
+            apply_decisions(username, decisions)
+        except InvalidDecision as e:
+            context['decision_error'] = str(e)
+            return render(request, 'courses/status.html', context)
 
-                linked_course.save()
+        return HttpResponseRedirect(page_url('/status/', pending_page.number))
 
-            else:
-                return render(request, 'courses/status.html', {'formset': formset, 
-                                                               'user_requested_courses': user_requested_courses})
 
-        # Prepare all the emails for sending. all_messages must be in the format (message1, message2, ...)
-        all_messages = ()
-        # Iterate through all instructors
-        for recipient in email_recipients.keys():
-            # Iterate through all messages to a specific instructor
-            for message in email_recipients[recipient]:
-                all_messages = all_messages + (message,)
+class ChildCourseDecisions(APIView):
+    """
+    Uses Django Rest Framework to let instructors approve or deny many requests to use their child courses at once.
+    Takes a JSON body of the form {"decisions": [{"pk": <BbMetaLinkedCourses pk>, "row_status": 0 or 2}, ...]}.
+    """
+
+    def post(self, request, format=None):
+        # SHIBBOLETH USE
+        # username = request.META['cn']  # 'cn' could also be replaced with 'REMOTE_USER'
 
-        send_mass_mail(all_messages, fail_silently=False)
+        username = 'sean_s'  # FOR TESTING ONLY
+        decisions = request.data.get('decisions') if hasattr(request.data, 'get') else None
+        if not isinstance(decisions, list):
+            return Response({'detail': 'Expected a list of decisions.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            pairs = [(int(decision['pk']), decision['row_status']) for decision in decisions]
+        except (KeyError, TypeError, ValueError):
+            return Response({'detail': 'Each decision needs a pk and a row_status.'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        return HttpResponseRedirect('/status/')
+        try:
+            decided = apply_decisions(username, pairs)
+        except InvalidDecision as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'decided': decided})
 
 
+@atomic_unless_safe
 def update_my_metas(request):
 	# SHIBBOLETH USE
     # username = request.META['cn']  # 'cn' could also be replaced with 'REMOTE_USER'
 
     username = 'sean_s'  # FOR TESTING ONLY
-    user_meta_courses = BbMetaCourses.objects.filter(instructor_id=username).values('pk1',
-                                                                                    'meta_course_name')
-    # create_add_link_form is a function wrapping the AddLinkedCoursesForm class; this is done to limit the meta course
-    # choices the user can select, i.e. displaying only the user's meta courses instead of every meta course.
-    add_link_form = create_add_link_form(username)
-    add_link_formset_cls = formset_factory(add_link_form)
+    # The user's meta courses and their add link formset class are cached until the user's meta courses change.
+    user_meta_courses = get_user_meta_courses(username)
+    add_link_formset_cls = get_add_link_formset_class(username)
+
+    # The user's enabled links are shown a page at a time. Each page's formset has its own prefix, and the page
+    #  number is sent back with the POST.
+    page_number = posted_page_number(request.POST.get('page', request.GET.get('page')))
+    enabled_links = enabled_links_for(username)
+    enabled_page = get_page(enabled_links, page_number, getattr(settings, 'FORMSET_PAGE_SIZE', 50))
 
     if request.method == 'GET':
-        remove_link_formset = RemoveMetaLinkedCoursesFormset(queryset=BbMetaLinkedCourses.objects.filter(row_status=0)
-                                                             .filter(requestor=username), prefix='remove_link_formset')
+        remove_link_formset = RemoveMetaLinkedCoursesFormset(queryset=enabled_page.object_list,
+                                                             prefix=page_prefix('remove_link_formset',
+                                                                                enabled_page.number))
         add_link_formset = add_link_formset_cls(prefix='add_link_formset')
         context = {'remove_link_formset': remove_link_formset,
+                   'enabled_page': enabled_page,
                    'user_meta_courses': user_meta_courses,
                    'add_link_formset': add_link_formset}
 
         return render(request, 'courses/my_meta_courses.html', context)
 
     if request.method == 'POST':
-        remove_link_formset = RemoveMetaLinkedCoursesFormset(request.POST, prefix='remove_link_formset')
+        # The prefix comes from the posted page number, which may be past the last page by now if links were
+        #  removed in the meantime.
+        remove_link_prefix = page_prefix('remove_link_formset', page_number)
+        # Only the posted rows are loaded, instead of the formset's default of every BbMetaLinkedCourses row.
+        remove_link_formset = RemoveMetaLinkedCoursesFormset(
+            request.POST, prefix=remove_link_prefix,
+            queryset=enabled_links.filter(pk__in=posted_pks(request.POST, remove_link_prefix, BbMetaLinkedCourses)))
         add_link_formset = add_link_formset_cls(request.POST, prefix='add_link_formset')
+
+        # As in approve_child_course, every removal is checked before any is saved, and a missing or tampered
+        #  management form is an error rather than a formset with no forms.
+        if not remove_link_formset.is_valid():
+            return render(request, 'courses/my_meta_courses.html', {'remove_link_formset': remove_link_formset,
+                                                                    'enabled_page': enabled_page,
+                                                                    'add_link_formset': add_link_formset,
+                                                                    'user_meta_courses': user_meta_courses})
+
         for form in remove_link_formset:
-            if form.is_valid():
-                # If the to_remove checkbox field is checked, form.cleaned_data['to_remove'] will equal True
-                if form.cleaned_data['to_remove']:
-                    linked_course = form.save(commit=False)
-                    linked_course.row_status = 2  # Disable the linked course
-                    linked_course.save()
-            else:
-                return render(request, 'courses/my_meta_courses.html', {'remove_link_formset': remove_link_formset,
-                                                                        'add_link_formset': add_link_formset,
-                                                                        'user_meta_courses': user_meta_courses})
+            # If the to_remove checkbox field is checked, form.cleaned_data['to_remove'] will equal True
+            if form.cleaned_data.get('to_remove'):
+                linked_course = form.save(commit=False)
+                linked_course.row_status = 2  # Disable the linked course
+                linked_course.save()
 
-        email_recipients = {}  # Add instructor usernames as keys to this dict.
-        email_subject = '[BB Meta Courses] New Request for Approval'
-        email_message = 'An instructor has requested to use one of your courses in a Meta Course. ' \
-                        + 'Please visit [URL REMOVED FROM PUBLIC CODE] to approve or deny this request. ' \
-                        + 'If you have any questions or concerns, please contact the IT@UC Help Desk by ' \
-                        + 'telephone at 513-556-HELP (4357) or by email at helpdesk@uc.edu.'
+        # The courses that need approval, grouped by their instructor so that each instructor gets one email.
+        approval_requests = {}
 
         for form in add_link_formset:
             if form.is_valid():
 
-                child_instructor = InstructorCourses.objects.filter(course_id=form.cleaned_data['child_course'])\
-                                                            .values('instructor_username')
-                if child_instructor:
+                child_instructor = course_catalog.instructor_of(form.cleaned_data['child_course'])
+                if child_instructor is not None:
                     course_link = form.save(commit=False)
                     course_link.requestor = username
-                    course_link.child_course_instructor = child_instructor[0]['instructor_username']
+                    course_link.child_course_instructor = child_instructor
                     if course_link.child_course_instructor == course_link.requestor:
                         course_link.row_status = 0  # Enabled
                     else:
                         course_link.row_status = 1  # Pending
-
-                        # Create email message that will be sent to instructors
-                        foreign_instructor = course_link.child_course_instructor
-                        if foreign_instructor not in email_recipients.keys():
-                            # If the foreign_instructor isn't already a key in email_recipients,
-                            #  add it along with its message.
-                            foreign_instructor_email = foreign_instructor + '@ucmail.uc.edu'
-                            # All messages must be in the format (subject, message, from_email, recipient_list)
-                            email_recipients[foreign_instructor] = (email_subject, email_message, 'EMAIL REMOVED',
-                                                                    [foreign_instructor_email])
+                        approval_requests.setdefault(course_link.child_course_instructor, [])\
+                            .append(course_link.child_course)
 
                     course_link.save()
 
             else:
                 return render(request, 'courses/my_meta_courses.html', {'remove_link_formset': remove_link_formset,
+                                                                        'enabled_page': enabled_page,
                                                                         'add_link_formset': add_link_formset,
                                                                         'user_meta_courses': user_meta_courses})
 
-        # Prepare all the emails for sending. all_messages must be in the format (message1, message2, ...)
-        all_messages = ()
-        for recipient in email_recipients.keys():
-            all_messages = all_messages + (email_recipients[recipient],)
+        # Queued in the same transaction as the new links above, and sent later by the deliver_outbox command.
+        for instructor, course_ids in approval_requests.items():
+            enqueue_digest(APPROVAL_REQUESTS, user_email(instructor), course_ids)
+
+        return HttpResponseRedirect(page_url('/metacourses/', enabled_page.number))
 
-        # send_mass_mail(all_messages, fail_silently=False)
 
-        return HttpResponseRedirect('/metacourses/')
+def lms_feed_export(request):
+    """
+    Streams the enabled meta course to child course mappings for the LMS feed, as CSV (the default) or NDJSON
+     (?format=ndjson). With ?since=<ISO 8601 datetime>, only the mappings changed after that time are sent, disabled
+     ones included. The X-Changed-Until header holds the time to pass as since on the next run.
+    """
+    feed_format = request.GET.get('format', 'csv')
+    if feed_format not in FEED_CONTENT_TYPES:
+        return JsonResponse({'detail': 'format must be one of: {0}.'.format(', '.join(sorted(FEED_CONTENT_TYPES)))},
+                            status=400)
+    try:
+        since = parse_since(request.GET.get('since'))
+    except ValueError:
+        return JsonResponse({'detail': 'since must be an ISO 8601 datetime.'}, status=400)
+
+    # Taken before the rows are read, so nothing that changes during the export is missed by the next one.
+    changed_until = timezone.now()
+    response = StreamingHttpResponse(feed_lines(feed_format, since), content_type=FEED_CONTENT_TYPES[feed_format])
+    response['Content-Disposition'] = 'attachment; filename="meta_course_links.{0}"'.format(feed_format)
+    response['X-Changed-Until'] = changed_until.isoformat()
+    return response
+
+
+def request_timings(request):
+    """
+    Returns the request timing histograms collected by TimingMiddleware in this process, per view, as JSON.
+    Empty unless COURSES_TIMING_ENABLED is True.
+    """
+    return JsonResponse(timing_stats.snapshot())